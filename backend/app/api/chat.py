@@ -1,31 +1,31 @@
 from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Form
 from typing import Optional, List
+import os
 import json
+import asyncio
 import base64
 import uuid
 
-from ..services.gemini_service import GeminiService
-from ..services.chat_context_service import chat_context_service
+from ..services.gemini_service import GeminiService, get_gemini_service
+from ..services.session_store import get_session_store
+from ..services.chat_context_service import MAX_SESSION_FILE_BYTES
 from app.models.chat import ChatMessage, ChatResponse
-from app.services.rag_service import RAGService
+from app.services.rag_service import RAGService, get_rag_service
 
 import logging
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Dependency to get RAG service
-def get_rag_service() -> RAGService:
-    return RAGService()
+PREVIOUS_CONTEXT_HEADER = "\n\nPrevious conversation context: "
 
-# Dependency to get Gemini service
-def get_gemini_service():
-    return GeminiService()
+# Caps in-flight Gemini chat calls per worker; excess requests wait here instead of piling onto the API
+_gemini_semaphore = asyncio.Semaphore(int(os.getenv("GEMINI_MAX_CONCURRENCY", 16)))
 
 @router.post("/start-session")
 async def start_chat_session():
     """Start a new chat session"""
-    session_id = chat_context_service.create_session()
+    session_id = await get_session_store().create_session()
     return {"session_id": session_id}
 
 @router.post("/upload-file")
@@ -39,33 +39,44 @@ async def upload_file_to_chat(
         
         print(f"📁 Attempting to upload {file.filename} to session {session_id}")
         
-        file_content = await file.read()
-        if len(file_content) == 0:
-            raise HTTPException(status_code=400, detail="Empty file")
-        
         # Check if session exists, create if it doesn't
-        context = chat_context_service.get_context(session_id)
-        if not context:
+        session_store = get_session_store()
+        if not await session_store.exists(session_id):
             print(f"🔄 Session {session_id} not found, creating new session")
             # Create session with the provided session_id
-            chat_context_service.chat_contexts[session_id] = {
-                'session_id': session_id,
-                'created_at': __import__('time').time(),
-                'messages': [],
-                'attached_files': [],
-                'context_summary': "",
-                'processed_file_summaries': []
-            }
+            await session_store.create_session(session_id)
         
-        file_data = {
-            'name': file.filename,
-            'type': file.content_type or 'application/octet-stream',
-            'content': file_content
-        }
-        
-        success = chat_context_service.add_attached_file(session_id, file_data)
-        if not success:
-            raise HTTPException(status_code=500, detail="Failed to attach file")
+        # The upload's bytes are reserved against the session's budget before streaming, so concurrent
+        # uploads to one session cannot together exceed it; any part not used by an attached file is
+        # released again. The upload is content-addressed so identical files are stored (and summarised) once
+        reserved = used = 0
+        try:
+            try:
+                reserved = await session_store.reserve_file_bytes(session_id, file.size, MAX_SESSION_FILE_BYTES)
+                if reserved is None:
+                    raise HTTPException(status_code=404, detail="Session not found")
+                stored = await session_store.store_upload(file, reserved)
+            except ValueError:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Session file limit exceeded. Maximum total size: {MAX_SESSION_FILE_BYTES} bytes"
+                )
+            if stored['size'] == 0:
+                raise HTTPException(status_code=400, detail="Empty file")
+            
+            file_data = {
+                **stored,
+                'name': file.filename,
+                'type': file.content_type or 'application/octet-stream'
+            }
+            
+            success = await session_store.add_attached_file(session_id, file_data)
+            if not success:
+                raise HTTPException(status_code=500, detail="Failed to attach file")
+            used = stored['size']
+        finally:
+            if reserved and reserved > used:
+                await session_store.release_file_bytes(session_id, reserved - used)
         
         print(f"✅ File {file.filename} uploaded successfully to session {session_id}")
         
@@ -75,7 +86,7 @@ async def upload_file_to_chat(
             "file_info": {
                 "name": file.filename,
                 "type": file.content_type or 'application/octet-stream',
-                "size": len(file_content)
+                "size": stored['size']
             }
         }
     except HTTPException:
@@ -97,18 +108,6 @@ async def send_message(
         if message_request.chat_session_id:
             attached_files_context = rag_service.get_chat_context(message_request.chat_session_id)
         
-        # Get RAG database context (from stored patient documents) - optional and separate
-        rag_database_context = ""
-        if hasattr(rag_service, 'similarity_search'):
-            try:
-                # Only search RAG database if user wants general medical knowledge
-                # Don't mix with attached files context
-                relevant_docs = rag_service.similarity_search(message_request.message, k=2)
-                if relevant_docs:
-                    rag_database_context = "\n".join([doc.get("content", "") for doc in relevant_docs])
-            except:
-                pass  # Continue without RAG database context
-        
         # Build context with clear separation
         context_parts = []
         
@@ -118,22 +117,20 @@ async def send_message(
             context_parts.append(attached_files_context)
             context_parts.append("=== END ATTACHED FILES ===")
         
-        # 2. Optional: RAG database context (secondary - from stored documents)
-        # if rag_database_context:
-        #     context_parts.append("=== GENERAL MEDICAL KNOWLEDGE ===")
-        #     context_parts.append(rag_database_context)
-        #     context_parts.append("=== END GENERAL KNOWLEDGE ===")
+        # The RAG patient database is deliberately not searched here: its results are kept
+        # separate from attached files and were never added to the prompt
         
-        # 3. User's question
+        # 2. User's question
         context_parts.append(f"USER QUESTION: {message_request.message}")
         
         final_context = "\n\n".join(context_parts) if context_parts else "No additional context available."
         
         # Generate response with clear context hierarchy
-        response = await gemini_service.generate_chat_response(
-            message_request.message,
-            final_context
-        )
+        async with _gemini_semaphore:
+            response = await gemini_service.generate_chat_response(
+                message_request.message,
+                final_context
+            )
         
         return ChatResponse(
             message=response,
@@ -153,45 +150,39 @@ async def chat_with_context(
 ):
     """Chat with file context support"""
     try:
-        # Get chat context
-        context = chat_context_service.get_context(session_id)
-        if not context:
+        # Add user message to context, reading back only the previous summary in the same round trip
+        session_store = get_session_store()
+        context = await session_store.add_message_and_get_fields(session_id, query, 'user', ['context_summary'])
+        if context is None:
             # Create new session if not found
-            session_id = chat_context_service.create_session()
-            context = chat_context_service.get_context(session_id)
-        
-        # Add user message to context
-        chat_context_service.add_message(session_id, query, 'user')
-        
+            session_id = await session_store.create_session()
+            context = await session_store.add_message_and_get_fields(session_id, query, 'user', ['context_summary'])
+
         # Get attached files
-        attached_files = chat_context_service.get_attached_files(session_id)
+        attached_files = await session_store.get_attached_files(session_id)
         
         # Prepare context for LLM
         base_context = patient_context or "No patient data available."
-        previous_context = context.get('context_summary', '')
+        previous_context = context.get('context_summary') or ''
         
-        full_context = f"{base_context}\n\nPrevious conversation context: {previous_context}"
+        full_context = "".join((base_context, PREVIOUS_CONTEXT_HEADER, previous_context))
         
         # Generate response with file attachments
-        if attached_files:
-            response = await gemini_service.generate_chat_response_with_files(
-                query=query,
-                context=full_context,
-                attached_files=attached_files
-            )
-        else:
-            response = await gemini_service.generate_chat_response(
-                query=query,
-                context=full_context
-            )
-        
-        # Add assistant response to context
-        chat_context_service.add_message(session_id, response, 'assistant')
-        
-        # Update context summary (keep last 5 exchanges for context)
-        messages = context['messages'][-10:]  # Keep last 10 messages
-        context_summary = "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
-        chat_context_service.update_context_summary(session_id, context_summary)
+        async with _gemini_semaphore:
+            if attached_files:
+                response = await gemini_service.generate_chat_response_with_files(
+                    query=query,
+                    context=full_context,
+                    attached_files=attached_files
+                )
+            else:
+                response = await gemini_service.generate_chat_response(
+                    query=query,
+                    context=full_context
+                )
+        
+        # Add assistant response and update context summary (keep last 5 exchanges for context)
+        await session_store.add_reply(session_id, response, summary_count=10)
         
         return {
             "response": response,
@@ -206,18 +197,19 @@ async def chat_with_context(
 async def get_session_files(session_id: str):
     """Get all files attached to a chat session"""
     try:
-        attached_files = chat_context_service.get_attached_files(session_id)
-        
-        # Return file info without content
-        file_list = []
-        for file_data in attached_files:
-            file_list.append({
-                "file_id": file_data.get('file_id'),
-                "name": file_data.get('name'),
-                "type": file_data.get('type'),
-                "uploaded_at": file_data.get('uploaded_at'),
-                "size": len(file_data.get('content', b''))
-            })
+        attached_files = await get_session_store().get_attached_files(session_id, load_content=False)
+        
+        # Return file info without content (these keys are always written by add_attached_file)
+        file_list = [
+            {
+                "file_id": f['file_id'],
+                "name": f['name'],
+                "type": f['type'],
+                "uploaded_at": f['uploaded_at_ns'] / 1e9,
+                "size": f['size']
+            }
+            for f in attached_files
+        ]
         
         return {"files": file_list}
     
@@ -227,7 +219,7 @@ async def get_session_files(session_id: str):
 @router.delete("/session/{session_id}")
 async def clear_chat_session(session_id: str):
     """Clear a chat session"""
-    success = chat_context_service.clear_session(session_id)
+    success = await get_session_store().clear_session(session_id)
     if not success:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -236,5 +228,5 @@ async def clear_chat_session(session_id: str):
 @router.get("/sessions")
 async def get_chat_sessions():
     """Get list of all chat sessions"""
-    sessions = chat_context_service.get_session_list()
+    sessions = await get_session_store().get_session_list()
     return {"sessions": sessions}
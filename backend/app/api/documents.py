@@ -10,21 +10,31 @@ import uuid
 import logging
 
 from app.models.patient import DocumentProcessingResult, PatientBase
-from app.services.gemini_service import GeminiService
+from app.services.gemini_service import GeminiService, get_gemini_service
 from app.models.patient import DocumentProcessingResultMulti
-from app.services.rag_service import RAGService
+from app.services.rag_service import RAGService, get_rag_service
 from app.services.tabular_processor import TabularProcessor
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Dependency to get Gemini service
-def get_gemini_service() -> GeminiService:
-    return GeminiService()
+def _format_document_attachment(filename: str, kind: str, doc_result: dict) -> str:
+    """Render an extracted document as chat context in a single template"""
+    get = doc_result.get
+    return f"""
+DOCUMENT ATTACHMENT: {filename} ({kind})
 
-# Dependency to get RAG service
-def get_rag_service() -> RAGService:
-    return RAGService()
+EXTRACTED CONTENT:
+{get('raw_text', 'No text extracted')}
+
+STRUCTURED DATA:
+- Name: {get('name', 'N/A')}
+- Date of Birth: {get('date_of_birth', 'N/A')}
+- Diagnosis: {get('diagnosis', 'N/A')}
+- Prescription: {get('prescription', 'N/A')}
+
+This document content is now available in the chat context.
+"""
 
 # Dependency to get TabularProcessor service
 def get_tabular_processor() -> TabularProcessor:
@@ -45,8 +55,13 @@ async def upload_document(
             detail=f"File type {file.content_type} not supported. Allowed types: {', '.join(allowed_types)}"
         )
     
-    # Validate file size (10MB max)
+    # Validate file size (10MB max); the declared size lets oversized uploads fail before they are read
     max_size = int(os.getenv("MAX_FILE_SIZE", 10485760))
+    if file.size is not None and file.size > max_size:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File size too large. Maximum size: {max_size} bytes"
+        )
     file_content = await file.read()
     if len(file_content) > max_size:
         raise HTTPException(
@@ -116,15 +131,23 @@ async def upload_multiple_documents(
     allowed_types = ['image/jpeg', 'image/png', 'image/jpg', 'text/plain', 'application/pdf']
     max_size = int(os.getenv("MAX_FILE_SIZE", 10485760))
 
-    # Validate all files and prepare payloads
-    files_data = []
-    total_bytes = 0
+    # Validate all files (type and declared size) before reading any of them
     for f in files:
         if f.content_type not in allowed_types:
             raise HTTPException(
                 status_code=400,
                 detail=f"File type {f.content_type} not supported. Allowed types: {', '.join(allowed_types)}"
             )
+        if f.size is not None and f.size > max_size:
+            raise HTTPException(
+                status_code=400,
+                detail=f"File {f.filename} exceeds maximum size of {max_size} bytes"
+            )
+
+    # Prepare payloads
+    files_data = []
+    total_bytes = 0
+    for f in files:
         content = await f.read()
         total_bytes += len(content)
         if len(content) > max_size:
@@ -211,6 +234,11 @@ async def attach_file_to_chat(
     
     # Validate file size (20MB max for chat attachments)
     max_size = int(os.getenv("MAX_CHAT_FILE_SIZE", 20971520))  # 20MB
+    if file.size is not None and file.size > max_size:
+        raise HTTPException(
+            status_code=400,
+            detail=f"File size too large. Maximum size: {max_size} bytes"
+        )
     file_content = await file.read()
     if len(file_content) > max_size:
         raise HTTPException(
@@ -271,20 +299,7 @@ This tabular data is now available for analysis and queries in this chat session
             if file.content_type.startswith('image/'):
                 # For images, we'll extract text content
                 doc_result = await gemini_service.extract_patient_data(file_content, file.content_type)
-                processed_content = f"""
-DOCUMENT ATTACHMENT: {filename} (Image)
-
-EXTRACTED CONTENT:
-{doc_result.get('raw_text', 'No text extracted')}
-
-STRUCTURED DATA:
-- Name: {doc_result.get('name', 'N/A')}
-- Date of Birth: {doc_result.get('date_of_birth', 'N/A')}
-- Diagnosis: {doc_result.get('diagnosis', 'N/A')}
-- Prescription: {doc_result.get('prescription', 'N/A')}
-
-This document content is now available in the chat context.
-"""
+                processed_content = _format_document_attachment(filename, "Image", doc_result)
                 metadata.update({
                     "extracted_data": doc_result,
                     "confidence_score": doc_result.get('confidence_score', 0.0)
@@ -293,20 +308,7 @@ This document content is now available in the chat context.
             elif file.content_type == 'application/pdf':
                 # Process PDF
                 doc_result = await gemini_service.extract_patient_data(file_content, file.content_type)
-                processed_content = f"""
-DOCUMENT ATTACHMENT: {filename} (PDF)
-
-EXTRACTED CONTENT:
-{doc_result.get('raw_text', 'No text extracted')}
-
-STRUCTURED DATA:
-- Name: {doc_result.get('name', 'N/A')}
-- Date of Birth: {doc_result.get('date_of_birth', 'N/A')}
-- Diagnosis: {doc_result.get('diagnosis', 'N/A')}
-- Prescription: {doc_result.get('prescription', 'N/A')}
-
-This document content is now available in the chat context.
-"""
+                processed_content = _format_document_attachment(filename, "PDF", doc_result)
                 metadata.update({
                     "extracted_data": doc_result,
                     "confidence_score": doc_result.get('confidence_score', 0.0)
@@ -1,12 +1,16 @@
 from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from typing import List, Optional, Dict, Any
+import os
+import asyncio
 import logging
 from pydantic import BaseModel
+from sqlalchemy.orm import Session
 
 # Import the new patient service
 from ..services.patient_service import get_patient_service
-from ..services.gemini_service import GeminiService
+from ..services.gemini_service import GeminiService, get_gemini_service
+from ..database import get_db
 
 logger = logging.getLogger(__name__)
 
@@ -21,34 +25,37 @@ class PatientCreateRequest(BaseModel):
     confidence_score: Optional[float] = None
     raw_text: Optional[str] = None
 
+# Fields of PatientCreateRequest that an update may change
+UPDATABLE_FIELDS = {"name", "date_of_birth", "diagnosis", "prescription"}
+
+# Routine failures (bad input incl. pydantic validation, upstream timeouts) are logged without
+# formatting a traceback; anything else, including DatabaseError, keeps its traceback and cause
+EXPECTED_ERRORS = (ValueError, TimeoutError)
+
+def _log_failure(error_msg: str, error: Exception):
+    """Log an endpoint failure, with the traceback only when the error is unexpected"""
+    logger.error(error_msg, exc_info=not isinstance(error, EXPECTED_ERRORS))
+
 @router.post("/", response_model=Dict[str, Any])
 async def create_patient(patient_data: PatientCreateRequest):
     """Create a new patient with direct field data (no files)"""
     try:
-        print(f"📥 Received request for patient creation with data: {patient_data}")
-        logger.info(f"Received request for patient creation")
+        logger.debug("Received request for patient creation with data: %s", patient_data)
         
         # Get patient service
         patient_service = get_patient_service()
         
-        # Convert Pydantic model to dict
-        patient_dict = {
-            "name": patient_data.name,
-            "date_of_birth": patient_data.date_of_birth,
-            "diagnosis": patient_data.diagnosis,
-            "prescription": patient_data.prescription,
-            "confidence_score": patient_data.confidence_score or 0.0,
-            "raw_text": patient_data.raw_text or ""
-        }
+        # Convert Pydantic model to dict (already validated, so dump it directly)
+        patient_dict = patient_data.model_dump()
+        patient_dict["confidence_score"] = patient_dict["confidence_score"] or 0.0
+        patient_dict["raw_text"] = patient_dict["raw_text"] or ""
         
-        print(f"🧠 Patient data to create: {patient_dict}")
-        logger.info(f"Patient data to create: {patient_dict}")
+        logger.debug("Patient data to create: %s", patient_dict)
         
         # Create patient using the service (handles both Supabase and SQLite)
         created_patient = await patient_service.create_patient(patient_dict)
         
-        print(f"✅ Patient created successfully: {created_patient}")
-        logger.info(f"Patient created successfully with ID: {created_patient.get('id')}")
+        logger.info("Patient created successfully with ID: %s", created_patient.get('id'))
         
         return {
             "success": True,
@@ -58,75 +65,64 @@ async def create_patient(patient_data: PatientCreateRequest):
         
     except Exception as e:
         error_msg = f"Failed to create patient: {str(e)}"
-        print(f"❌ {error_msg}")
-        logger.error(error_msg, exc_info=True)
+        _log_failure(error_msg, e)
         raise HTTPException(status_code=500, detail=error_msg)
 
 # Keep the file-based endpoint for document processing, but rename it
 @router.post("/from-files", response_model=Dict[str, Any])
-async def create_patient_from_files(files: List[UploadFile] = File(None)):
+async def create_patient_from_files(
+    files: List[UploadFile] = File(None),
+    gemini_service: GeminiService = Depends(get_gemini_service)
+):
     """Create a new patient from uploaded documents"""
     try:
-        print(f"📥 Received request for patient creation")
-        print(f"📋 Files parameter: {files}")
-        print(f"📋 Files type: {type(files)}")
-        
-        logger.info(f"Received request for patient creation")
-        
         # Handle case where files might be None or empty
         if not files:
-            print("❌ No files provided")
             raise HTTPException(status_code=400, detail="No files uploaded")
             
         # Check if we received empty file upload
         if len(files) == 1 and (not files[0].filename or files[0].filename == ''):
-            print("❌ Empty file upload detected")
             raise HTTPException(status_code=400, detail="No valid files uploaded")
         
-        print(f"📁 Processing {len(files)} files")
-        logger.info(f"Processing {len(files)} files")
-        
         # Get services
         patient_service = get_patient_service()
-        gemini_service = GeminiService()
         
-        # Process files with Gemini
-        files_data = []
-        for i, file in enumerate(files):
-            print(f"📄 File {i}: {file.filename}, type: {file.content_type}")
-            if file.filename:  # Skip empty files
-                content = await file.read()
-                print(f"📄 File {i} content size: {len(content)} bytes")
-                files_data.append({
-                    'content': content,
-                    'name': file.filename,
-                    'type': file.content_type or 'application/octet-stream'
-                })
+        # Skip empty files and reject oversized ones from their declared size, before reading any bodies
+        max_size = int(os.getenv("MAX_FILE_SIZE", 10485760))
+        valid_files = [file for file in files if file.filename and file.size != 0]
+        oversized = next((file for file in valid_files if (file.size or 0) > max_size), None)
+        if oversized:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File {oversized.filename} exceeds maximum size of {max_size} bytes"
+            )
+        
+        # Process files with Gemini (uploads are read concurrently)
+        contents = await asyncio.gather(*(file.read() for file in valid_files))
+        files_data = [
+            {
+                'content': content,
+                'name': file.filename,
+                'type': file.content_type or 'application/octet-stream'
+            }
+            for file, content in zip(valid_files, contents)
+        ]
         
         if not files_data:
             raise HTTPException(status_code=400, detail="No valid files to process")
         
-        print(f"📋 Processing {len(files_data)} valid files")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Processing files: %s", [(f['name'], f['type'], len(f['content'])) for f in files_data])
         
-        # Extract patient data
-        if len(files_data) == 1:
-            # Single file processing
-            patient_data = await gemini_service.extract_patient_data(
-                files_data[0]['content'],
-                files_data[0]['type']
-            )
-        else:
-            # Multiple files processing
-            patient_data = await gemini_service.extract_patient_data_from_multiple_files(files_data)
+        # Extract patient data (single or multiple files; identical concurrent uploads share one call)
+        patient_data = await gemini_service.extract_patient_data_coalesced(files_data)
         
-        print(f"🧠 Extracted patient data: {patient_data}")
-        logger.info(f"Extracted patient data: {patient_data}")
+        logger.debug("Extracted patient data: %s", patient_data)
         
         # Create patient using the service (handles both Supabase and SQLite)
         created_patient = await patient_service.create_patient(patient_data)
         
-        print(f"✅ Patient created successfully: {created_patient}")
-        logger.info(f"Patient created successfully with ID: {created_patient.get('id')}")
+        logger.info("Patient created successfully with ID: %s", created_patient.get('id'))
         
         return {
             "success": True,
@@ -138,16 +134,14 @@ async def create_patient_from_files(files: List[UploadFile] = File(None)):
         raise
     except Exception as e:
         error_msg = f"Failed to create patient: {str(e)}"
-        print(f"❌ {error_msg}")
-        logger.error(error_msg, exc_info=True)
+        _log_failure(error_msg, e)
         raise HTTPException(status_code=500, detail=error_msg)
 
 @router.post("/test", response_model=Dict[str, Any])
 async def test_endpoint(files: List[UploadFile] = File(None)):
     """Test endpoint to debug file upload issues"""
     try:
-        print(f"🧪 TEST: Received request")
-        logger.info("TEST: Received request")
+        logger.debug("TEST: Received request")
         
         if not files:
             return {"message": "No files received", "files": None}
@@ -155,12 +149,12 @@ async def test_endpoint(files: List[UploadFile] = File(None)):
         files_info = []
         for i, file in enumerate(files):
             if file and file.filename:
-                content_size = len(await file.read())
+                # Multipart parsing records the size, so the body is never read here
                 files_info.append({
                     "index": i,
                     "filename": file.filename,
                     "content_type": file.content_type,
-                    "size": content_size
+                    "size": file.size
                 })
         
         return {
@@ -179,16 +173,16 @@ async def get_patients(limit: int = 100):
         patient_service = get_patient_service()
         patients = await patient_service.get_all_patients(limit)
         
-        return {
+        # Returned as a response directly so the list skips jsonable_encoder and goes straight to orjson
+        return ORJSONResponse({
             "success": True,
             "patients": patients,
             "count": len(patients)
-        }
+        })
         
     except Exception as e:
         error_msg = f"Failed to retrieve patients: {str(e)}"
-        print(f"❌ {error_msg}")
-        logger.error(error_msg, exc_info=True)
+        _log_failure(error_msg, e)
         raise HTTPException(status_code=500, detail=error_msg)
 
 @router.get("/{patient_id}", response_model=Dict[str, Any])
@@ -201,69 +195,38 @@ async def get_patient(patient_id: int):
         if not patient:
             raise HTTPException(status_code=404, detail="Patient not found")
         
-        return {
+        return ORJSONResponse({
             "success": True,
             "patient": patient
-        }
+        })
         
     except HTTPException:
         raise
     except Exception as e:
         error_msg = f"Failed to retrieve patient: {str(e)}"
-        print(f"❌ {error_msg}")
-        logger.error(error_msg, exc_info=True)
+        _log_failure(error_msg, e)
         raise HTTPException(status_code=500, detail=error_msg)
 
 @router.put("/{patient_id}", response_model=Dict[str, Any])
-async def update_patient(patient_id: int, patient_data: PatientCreateRequest):
+async def update_patient(patient_id: int, patient_data: PatientCreateRequest, db: Session = Depends(get_db)):
     """Update an existing patient"""
     try:
-        print(f"📝 Updating patient ID {patient_id} with data: {patient_data}")
-        logger.info(f"Updating patient ID {patient_id}")
+        logger.debug("Updating patient ID %s with data: %s", patient_id, patient_data)
         
         # Get patient service
         patient_service = get_patient_service()
         
-        # Convert Pydantic model to dict
-        update_dict = {
-            "name": patient_data.name,
-            "date_of_birth": patient_data.date_of_birth,
-            "diagnosis": patient_data.diagnosis,
-            "prescription": patient_data.prescription
-        }
+        # Convert Pydantic model to dict (only the editable fields)
+        update_dict = patient_data.model_dump(include=UPDATABLE_FIELDS)
         
-        # Update patient using the service
-        if patient_service.db_type == "supabase":
-            # For Supabase, we need to use the SupabaseService
-            from ..services.supabase_service import SupabaseService
-            supabase_service = SupabaseService()
-            updated_patient = await supabase_service.update_patient(patient_id, update_dict)
-        else:
-            # For SQLite fallback
-            from ..database import SessionLocal
-            from ..services.database_service import DatabaseService
-            db = SessionLocal()
-            try:
-                db_service = DatabaseService(db)
-                updated_patient = db_service.update_patient(str(patient_id), update_dict)
-                if updated_patient:
-                    updated_patient = {
-                        "id": updated_patient.id,
-                        "name": updated_patient.name,
-                        "date_of_birth": updated_patient.date_of_birth,
-                        "diagnosis": updated_patient.diagnosis,
-                        "prescription": updated_patient.prescription,
-                        "created_at": updated_patient.created_at.isoformat() if updated_patient.created_at else None,
-                        "updated_at": updated_patient.updated_at.isoformat() if updated_patient.updated_at else None
-                    }
-            finally:
-                db.close()
+        # Update patient using the service (handles both Supabase and SQLite; the request
+        # session is only used by the SQLite fallback)
+        updated_patient = await patient_service.update_patient(patient_id, update_dict, db)
         
         if not updated_patient:
             raise HTTPException(status_code=404, detail="Patient not found")
         
-        print(f"✅ Patient updated successfully: {updated_patient}")
-        logger.info(f"Patient updated successfully with ID: {patient_id}")
+        logger.info("Patient updated successfully with ID: %s", patient_id)
         
         return {
             "success": True,
@@ -275,42 +238,25 @@ async def update_patient(patient_id: int, patient_data: PatientCreateRequest):
         raise
     except Exception as e:
         error_msg = f"Failed to update patient: {str(e)}"
-        print(f"❌ {error_msg}")
-        logger.error(error_msg, exc_info=True)
+        _log_failure(error_msg, e)
         raise HTTPException(status_code=500, detail=error_msg)
 
 @router.delete("/{patient_id}", response_model=Dict[str, Any])
-async def delete_patient(patient_id: int):
+async def delete_patient(patient_id: int, db: Session = Depends(get_db)):
     """Delete a patient"""
     try:
-        print(f"🗑️ Deleting patient ID {patient_id}")
-        logger.info(f"Deleting patient ID {patient_id}")
+        logger.debug("Deleting patient ID %s", patient_id)
         
         # Get patient service
         patient_service = get_patient_service()
         
-        # Delete patient using the service
-        if patient_service.db_type == "supabase":
-            # For Supabase, we need to use the SupabaseService
-            from ..services.supabase_service import SupabaseService
-            supabase_service = SupabaseService()
-            success = await supabase_service.delete_patient(patient_id)
-        else:
-            # For SQLite fallback
-            from ..database import SessionLocal
-            from ..services.database_service import DatabaseService
-            db = SessionLocal()
-            try:
-                db_service = DatabaseService(db)
-                success = db_service.delete_patient(str(patient_id))
-            finally:
-                db.close()
+        # Delete patient using the service (handles both Supabase and SQLite)
+        success = await patient_service.delete_patient(patient_id, db)
         
         if not success:
             raise HTTPException(status_code=404, detail="Patient not found")
         
-        print(f"✅ Patient deleted successfully: ID {patient_id}")
-        logger.info(f"Patient deleted successfully with ID: {patient_id}")
+        logger.info("Patient deleted successfully with ID: %s", patient_id)
         
         return {
             "success": True,
@@ -321,8 +267,7 @@ async def delete_patient(patient_id: int):
         raise
     except Exception as e:
         error_msg = f"Failed to delete patient: {str(e)}"
-        print(f"❌ {error_msg}")
-        logger.error(error_msg, exc_info=True)
+        _log_failure(error_msg, e)
         raise HTTPException(status_code=500, detail=error_msg)
 
 @router.get("/search/{search_term}", response_model=Dict[str, Any])
@@ -332,17 +277,16 @@ async def search_patients(search_term: str, limit: int = 50):
         patient_service = get_patient_service()
         patients = await patient_service.search_patients(search_term, limit)
         
-        return {
+        return ORJSONResponse({
             "success": True,
             "patients": patients,
             "count": len(patients),
             "search_term": search_term
-        }
+        })
         
     except Exception as e:
         error_msg = f"Failed to search patients: {str(e)}"
-        print(f"❌ {error_msg}")
-        logger.error(error_msg, exc_info=True)
+        _log_failure(error_msg, e)
         raise HTTPException(status_code=500, detail=error_msg)
 
 @router.get("/stats/overview", response_model=Dict[str, Any])
@@ -359,8 +303,7 @@ async def get_patient_stats():
         
     except Exception as e:
         error_msg = f"Failed to retrieve patient stats: {str(e)}"
-        print(f"❌ {error_msg}")
-        logger.error(error_msg, exc_info=True)
+        _log_failure(error_msg, e)
         raise HTTPException(status_code=500, detail=error_msg)
 
 @router.get("/health/check", response_model=Dict[str, Any])
@@ -378,8 +321,7 @@ async def health_check():
         
     except Exception as e:
         error_msg = f"Health check failed: {str(e)}"
-        print(f"❌ {error_msg}")
-        logger.error(error_msg, exc_info=True)
+        _log_failure(error_msg, e)
         raise HTTPException(status_code=500, detail=error_msg)
 
 @router.get("/health/check", response_model=Dict[str, Any])
@@ -397,6 +339,5 @@ async def health_check():
         
     except Exception as e:
         error_msg = f"Health check failed: {str(e)}"
-        print(f"❌ {error_msg}")
-        logger.error(error_msg, exc_info=True)
+        _log_failure(error_msg, e)
         raise HTTPException(status_code=500, detail=error_msg)
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, String, Text, DateTime
+from sqlalchemy import create_engine, event, Column, String, Text, DateTime
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import func
@@ -15,22 +15,39 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./patients.db")
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-# Create engine with appropriate settings for PostgreSQL vs SQLite
+# Create the engine once per process with appropriate settings for PostgreSQL vs SQLite;
+# every request session borrows a pooled connection from it
 if DATABASE_URL.startswith("postgresql://"):
-    # PostgreSQL configuration
+    # PostgreSQL configuration for Supabase
     engine = create_engine(
         DATABASE_URL,
-        pool_pre_ping=True,
-        pool_recycle=300,
-        echo=False  # Set to True for SQL debugging
+        pool_pre_ping=True,      # Verify connections before use
+        pool_recycle=1800,       # Recycle connections every 30 minutes
+        pool_size=5,             # Connection pool size
+        max_overflow=10,         # Max overflow connections
+        echo=False               # Set to True for SQL debugging
     )
+    print("🐘 Using PostgreSQL database (Supabase)")
 else:
-    # SQLite configuration
+    # SQLite configuration (development fallback)
     engine = create_engine(
         DATABASE_URL,
         connect_args={"check_same_thread": False},
         echo=False
     )
+    print("📁 Using SQLite database (development mode)")
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Tune each new SQLite connection: WAL lets readers run alongside the writer,
+        NORMAL sync avoids an fsync per commit, and busy_timeout waits out lock contention"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.execute("PRAGMA cache_size=-20000")  # ~20MB page cache
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -46,51 +63,11 @@ class Patient(Base):
     date_of_birth = Column(String, nullable=False, index=True)  # Store as string in YYYY-MM-DD format
     diagnosis = Column(Text, nullable=True)
     prescription = Column(Text, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)  # Patient lists are ordered by newest first
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
-# Create tables
-def create_tables():
-    Base.metadata.create_all(bind=engine)
-
-import os
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-
-# Database URL - supports both SQLite (development) and PostgreSQL (production)
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./patients.db")
-
-# Handle Railway/Heroku postgres URL format (postgres:// -> postgresql://)
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-
-# Create engine with appropriate settings for PostgreSQL vs SQLite
-if DATABASE_URL.startswith("postgresql://"):
-    # PostgreSQL configuration for Supabase
-    engine = create_engine(
-        DATABASE_URL,
-        pool_pre_ping=True,      # Verify connections before use
-        pool_recycle=3600,       # Recycle connections every hour
-        pool_size=5,             # Connection pool size
-        max_overflow=10,         # Max overflow connections
-        echo=False               # Set to True for SQL debugging
-    )
-    print("🐘 Using PostgreSQL database (Supabase)")
-else:
-    # SQLite configuration (development fallback)
-    engine = create_engine(
-        DATABASE_URL,
-        connect_args={"check_same_thread": False},
-        echo=False
-    )
-    print("📁 Using SQLite database (development mode)")
-
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-def get_database():
-    """Dependency to get database session"""
+def get_db():
+    """Dependency to get a database session for the duration of a request"""
     db = SessionLocal()
     try:
         yield db
@@ -111,9 +88,3 @@ def create_tables():
         print("✅ SQLite database tables created successfully")
     else:
         print("⚠️ PostgreSQL detected - use Supabase dashboard to create tables")
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
@@ -1,25 +1,38 @@
 from typing import Dict, Any, List, Optional
+import os
 import uuid
 import time
 import logging
 
+from ..utils.ttl_cache import TTLCache
+
 logger = logging.getLogger(__name__)
 
+# Idle sessions (and their files) expire after this many seconds
+SESSION_TTL_SECONDS = int(os.getenv("CHAT_SESSION_TTL", 3600))
+# Upper bound on sessions kept in memory; least recently used are evicted first
+MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", 10000))
+# Upper bound on processed file summaries kept in memory
+MAX_FILE_SUMMARIES = int(os.getenv("CHAT_MAX_FILE_SUMMARIES", 2048))
+# Total bytes of attached files allowed per session
+MAX_SESSION_FILE_BYTES = int(os.getenv("MAX_SESSION_FILE_BYTES", 52428800))  # 50MB
+
 class ChatContextService:
     def __init__(self):
-        # In-memory storage for chat contexts (in production, use Redis or database)
-        self.chat_contexts: Dict[str, Dict[str, Any]] = {}
-        # Cache for processed file summaries to avoid reprocessing
-        self.file_processing_cache: Dict[str, str] = {}
+        # In-memory storage for chat contexts (use REDIS_URL to share sessions across workers)
+        self.chat_contexts = TTLCache(maxsize=MAX_SESSIONS, ttl=SESSION_TTL_SECONDS)
+        # Cache for processed file summaries to avoid reprocessing (swept by the background janitor)
+        self.file_processing_cache = TTLCache(maxsize=MAX_FILE_SUMMARIES, ttl=SESSION_TTL_SECONDS)
     
-    def create_session(self) -> str:
+    def create_session(self, session_id: Optional[str] = None) -> str:
         """Create a new chat session and return session ID"""
-        session_id = str(uuid.uuid4())
+        session_id = session_id or str(uuid.uuid4())
         self.chat_contexts[session_id] = {
             'session_id': session_id,
-            'created_at': time.time(),
+            'created_at_ns': time.time_ns(),
             'messages': [],
             'attached_files': [],
+            'files_bytes': 0,  # Bytes reserved for attached files (see reserve_file_bytes)
             'context_summary': "",
             'processed_file_summaries': []  # Cache processed summaries
         }
@@ -33,7 +46,7 @@ class ChatContextService:
         self.chat_contexts[session_id]['messages'].append({
             'role': role,
             'content': message,
-            'timestamp': time.time()
+            'ts_ns': time.time_ns()
         })
         return True
     
@@ -42,16 +55,18 @@ class ChatContextService:
         if session_id not in self.chat_contexts:
             return False
         
-        # Add file to session context
+        # File bytes live in the upload spool; the session only keeps metadata
         file_info = {
-            'file_id': str(uuid.uuid4()),
+            'file_id': file_data.get('file_id') or str(uuid.uuid4()),
             'name': file_data.get('name'),
             'type': file_data.get('type'),
-            'content': file_data.get('content'),
+            'size': file_data.get('size', 0),
+            'encoding': file_data.get('encoding'),  # Storage encoding of the spooled bytes
             'processed_content': None,  # Will be filled when processed
-            'uploaded_at': time.time()
+            'uploaded_at_ns': time.time_ns()
         }
         
+        # The file's bytes were already counted by reserve_file_bytes before it was stored
         self.chat_contexts[session_id]['attached_files'].append(file_info)
         return True
     
@@ -59,6 +74,12 @@ class ChatContextService:
         """Cache processed file summary to avoid reprocessing"""
         self.file_processing_cache[file_id] = summary
     
+    @staticmethod
+    def file_summary_key(file_id: str, file_name: Optional[str]) -> str:
+        """Key a processed summary by content digest plus length-prefixed filename (summaries name the file)"""
+        file_name = file_name or ""
+        return f"{file_id}:{len(file_name)}:{file_name}"
+    
     def get_cached_file_summary(self, file_id: str) -> Optional[str]:
         """Get cached file summary if available"""
         return self.file_processing_cache.get(file_id)
@@ -68,9 +89,37 @@ class ChatContextService:
         return self.chat_contexts.get(session_id)
     
     def get_attached_files(self, session_id: str) -> List[Dict[str, Any]]:
-        """Get all attached files for a session"""
+        """Get metadata for all attached files in a session"""
         context = self.chat_contexts.get(session_id, {})
-        return context.get('attached_files', [])
+        return [dict(file_info) for file_info in context.get('attached_files', [])]
+    
+    def get_recent_messages(self, session_id: str, count: int) -> List[Dict[str, Any]]:
+        """Get the last `count` messages for a session"""
+        context = self.chat_contexts.get(session_id, {})
+        return context.get('messages', [])[-count:]
+    
+    def reserve_file_bytes(self, session_id: str, nbytes: Optional[int], limit: int) -> Optional[int]:
+        """Reserve upload bytes against a session's file budget (all that is left if nbytes is None).
+    
+        Returns the bytes reserved, or None if the session does not exist; raises ValueError
+        if they do not fit. Check and increment run without yielding, so they are atomic per worker.
+        """
+        context = self.chat_contexts.get(session_id)
+        if context is None:
+            return None
+        remaining = limit - context['files_bytes']
+        if nbytes is None:
+            nbytes = max(remaining, 0)
+        if nbytes > remaining:
+            raise ValueError(f"Session file budget of {limit} bytes exceeded")
+        context['files_bytes'] += nbytes
+        return nbytes
+    
+    def release_file_bytes(self, session_id: str, nbytes: int):
+        """Return reserved upload bytes that were not used to the session's budget"""
+        context = self.chat_contexts.get(session_id)
+        if context is not None:
+            context['files_bytes'] = max(context['files_bytes'] - nbytes, 0)
     
     def get_optimized_context(self, session_id: str) -> str:
         """Get optimized context for LLM processing (reduced size)"""
@@ -107,7 +156,7 @@ class ChatContextService:
         for session_id, context in self.chat_contexts.items():
             sessions.append({
                 'session_id': session_id,
-                'created_at': context['created_at'],
+                'created_at': context['created_at_ns'] / 1e9,
                 'message_count': len(context['messages']),
                 'file_count': len(context['attached_files'])
             })
@@ -119,6 +168,13 @@ class ChatContextService:
             del self.chat_contexts[session_id]
             return True
         return False
+    
+    def expire_stale(self) -> int:
+        """Evict idle sessions and file summaries past their TTL"""
+        removed = self.chat_contexts.expire() + self.file_processing_cache.expire()
+        if removed:
+            logger.info(f"Expired {removed} idle chat sessions/file summaries")
+        return removed
 
 # Global instance
 chat_context_service = ChatContextService()
\ No newline at end of file
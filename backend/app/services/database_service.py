@@ -1,3 +1,4 @@
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from app.database import get_db, Patient as PatientDBModel
@@ -6,6 +7,21 @@ from typing import List, Optional
 import uuid
 from datetime import datetime
 
+class DatabaseError(Exception):
+    """A patient query failed in the database layer"""
+
+def _to_patient(db_patient: PatientDBModel) -> Patient:
+    """Convert a patient row to the API model"""
+    return Patient(
+        id=db_patient.id,
+        name=db_patient.name,
+        date_of_birth=db_patient.date_of_birth,
+        diagnosis=db_patient.diagnosis,
+        prescription=db_patient.prescription,
+        created_at=db_patient.created_at,
+        updated_at=db_patient.updated_at
+    )
+
 class DatabaseService:
     def __init__(self, db: Session):
         self.db = db
@@ -28,38 +44,22 @@ class DatabaseService:
             self.db.commit()
             self.db.refresh(db_patient)
             
-            return Patient(
-                id=db_patient.id,
-                name=db_patient.name,
-                date_of_birth=db_patient.date_of_birth,
-                diagnosis=db_patient.diagnosis,
-                prescription=db_patient.prescription,
-                created_at=db_patient.created_at,
-                updated_at=db_patient.updated_at
-            )
+            return _to_patient(db_patient)
         except SQLAlchemyError as e:
             self.db.rollback()
-            raise Exception(f"Database error: {str(e)}")
+            raise DatabaseError(f"Database error: {str(e)}") from e
     
-    def get_all_patients(self) -> List[Patient]:
-        """Get all patient records"""
+    def get_all_patients(self, limit: Optional[int] = None) -> List[Patient]:
+        """Get all patient records, newest first (optionally only the first `limit`)"""
         try:
-            db_patients = self.db.query(PatientDBModel).order_by(PatientDBModel.created_at.desc()).all()
+            query = self.db.query(PatientDBModel).order_by(PatientDBModel.created_at.desc())
+            if limit is not None:
+                query = query.limit(limit)
+            db_patients = query.all()
             
-            return [
-                Patient(
-                    id=patient.id,
-                    name=patient.name,
-                    date_of_birth=patient.date_of_birth,
-                    diagnosis=patient.diagnosis,
-                    prescription=patient.prescription,
-                    created_at=patient.created_at,
-                    updated_at=patient.updated_at
-                )
-                for patient in db_patients
-            ]
+            return [_to_patient(patient) for patient in db_patients]
         except SQLAlchemyError as e:
-            raise Exception(f"Database error: {str(e)}")
+            raise DatabaseError(f"Database error: {str(e)}") from e
     
     def get_patient_by_id(self, patient_id: str) -> Optional[Patient]:
         """Get a patient by ID"""
@@ -69,17 +69,40 @@ class DatabaseService:
             if not db_patient:
                 return None
                 
-            return Patient(
-                id=db_patient.id,
-                name=db_patient.name,
-                date_of_birth=db_patient.date_of_birth,
-                diagnosis=db_patient.diagnosis,
-                prescription=db_patient.prescription,
-                created_at=db_patient.created_at,
-                updated_at=db_patient.updated_at
+            return _to_patient(db_patient)
+        except SQLAlchemyError as e:
+            raise DatabaseError(f"Database error: {str(e)}") from e
+    
+    def search_patients(self, search_term: str, limit: int = 50) -> List[Patient]:
+        """Get the newest patients whose name or diagnosis contains the search term"""
+        try:
+            # The term is matched literally: backslash, % and _ are escaped for LIKE
+            escaped = search_term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            pattern = f"%{escaped}%"
+            db_patients = (
+                self.db.query(PatientDBModel)
+                .filter(or_(
+                    PatientDBModel.name.ilike(pattern, escape="\\"),
+                    PatientDBModel.diagnosis.ilike(pattern, escape="\\")
+                ))
+                .order_by(PatientDBModel.created_at.desc())
+                .limit(limit)
+                .all()
             )
+            
+            return [_to_patient(patient) for patient in db_patients]
         except SQLAlchemyError as e:
-            raise Exception(f"Database error: {str(e)}")
+            raise DatabaseError(f"Database error: {str(e)}") from e
+    
+    def count_patients(self, created_since: Optional[datetime] = None) -> int:
+        """Count patients, optionally only those created on or after `created_since`"""
+        try:
+            query = self.db.query(func.count(PatientDBModel.id))
+            if created_since is not None:
+                query = query.filter(PatientDBModel.created_at >= created_since)
+            return query.scalar() or 0
+        except SQLAlchemyError as e:
+            raise DatabaseError(f"Database error: {str(e)}") from e
     
     def update_patient(self, patient_id: str, patient_data: PatientUpdate) -> Optional[Patient]:
         """Update a patient record"""
@@ -106,18 +129,10 @@ class DatabaseService:
             self.db.commit()
             self.db.refresh(db_patient)
             
-            return Patient(
-                id=db_patient.id,
-                name=db_patient.name,
-                date_of_birth=db_patient.date_of_birth,
-                diagnosis=db_patient.diagnosis,
-                prescription=db_patient.prescription,
-                created_at=db_patient.created_at,
-                updated_at=db_patient.updated_at
-            )
+            return _to_patient(db_patient)
         except SQLAlchemyError as e:
             self.db.rollback()
-            raise Exception(f"Database error: {str(e)}")
+            raise DatabaseError(f"Database error: {str(e)}") from e
     
     def delete_patient(self, patient_id: str) -> bool:
         """Delete a patient record"""
@@ -133,7 +148,7 @@ class DatabaseService:
             
         except SQLAlchemyError as e:
             self.db.rollback()
-            raise Exception(f"Database error: {str(e)}")
+            raise DatabaseError(f"Database error: {str(e)}") from e
 
 # Dependency to get database service
 def get_database_service(db: Session) -> DatabaseService:
@@ -1,12 +1,15 @@
 import google.generativeai as genai
 from google import genai as google_client
 import os
+import asyncio
 from typing import Dict, Any, Optional, List
 import json
 import logging
 from PIL import Image
 import io
+import copy
 import base64
+import hashlib
 import mimetypes
 import tempfile
 import shutil
@@ -23,6 +26,42 @@ if not logger.handlers:
     logger.addHandler(handler)
     logger.propagate = True
 
+# Fixed pieces of the file-chat prompt, joined around the per-request values
+FILES_CHAT_PROMPT_HEAD = """
+        You are a helpful medical assistant with access to patient data and any uploaded documents.
+        
+        Context: """
+FILES_CHAT_PROMPT_FILES = """  
+        
+        File Data: """
+FILES_CHAT_PROMPT_QUERY = """
+        
+        User Question: """
+FILES_CHAT_PROMPT_TAIL = """
+        
+        Please provide a concise, helpful response. Use bullet points and formatting where appropriate.
+        Keep responses focused and under 500 words unless specifically asked for detailed analysis.
+        """
+
+def _cap(text: str, limit: int) -> str:
+    """Truncate text to `limit` characters, returning it untouched when already short enough"""
+    return text if len(text) <= limit else text[:limit]
+
+# Caps how many attached files are processed (uploaded / sent to Gemini) at once per worker
+_file_processing_semaphore = asyncio.Semaphore(int(os.getenv("FILE_PROCESSING_CONCURRENCY", 8)))
+
+# Patient extractions currently running, keyed by a digest of their input files
+_inflight_extractions: Dict[str, "asyncio.Future[Dict[str, Any]]"] = {}
+
+def _files_digest(files_data: List[Dict[str, Any]]) -> str:
+    """Digest the name, type and bytes of each file (length-prefixed so fields cannot run together)"""
+    digest = hashlib.sha256()
+    for file_data in files_data:
+        for part in ((file_data.get('name') or '').encode(), (file_data.get('type') or '').encode(), file_data.get('content') or b''):
+            digest.update(len(part).to_bytes(8, 'little'))
+            digest.update(part)
+    return digest.hexdigest()
+
 class GeminiService:
     def __init__(self):
         api_key = os.getenv("GEMINI_API_KEY")
@@ -122,7 +161,7 @@ class GeminiService:
                 print("📷 Processing as image document")
                 logger.info("Processing as image document")
                 image = Image.open(io.BytesIO(file_content))
-                response = self._generate_content_with_image(prompt, image)
+                response = await asyncio.to_thread(self._generate_content_with_image, prompt, image)
             elif file_type == 'application/pdf':
                 # Process PDF file - use Gemini file upload API for better PDF handling
                 print("📄 Processing as PDF document using file upload API")
@@ -135,14 +174,16 @@ class GeminiService:
                     with open(pdf_path, 'wb') as f:
                         f.write(file_content)
                     
-                    # Upload to Gemini - use 'file' parameter instead of 'path'
-                    uploaded_file = self.client.files.upload(
+                    # Upload to Gemini - use 'file' parameter instead of 'path' (blocking SDK calls run in a thread)
+                    uploaded_file = await asyncio.to_thread(
+                        self.client.files.upload,
                         file=pdf_path,
                         config={"mime_type": "application/pdf"}
                     )
                     
                     # Generate content using uploaded file with proper message structure
-                    resp_obj = self.client.models.generate_content(
+                    resp_obj = await asyncio.to_thread(
+                        self.client.models.generate_content,
                         model="gemini-2.0-flash-exp",
                         contents=[
                             {"role": "user", "parts": [
@@ -174,7 +215,7 @@ class GeminiService:
                 full_prompt = f"{prompt}\n\n{text_content}"
                 print(f"📝 Text content length: {len(text_content)} characters")
                 logger.info(f"Text content length: {len(text_content)} characters")
-                response = self._generate_content_with_text(full_prompt)
+                response = await asyncio.to_thread(self._generate_content_with_text, full_prompt)
             
             print("=== 🤖 FULL LLM RESPONSE ===")
             print(response)
@@ -242,8 +283,9 @@ class GeminiService:
                 # Upload to Gemini
                 print(f"🔄 Uploading {file_name} to Gemini...")
                 try:
-                    uploaded_file = self.client.files.upload(
-                        file=file_path, 
+                    uploaded_file = await asyncio.to_thread(
+                        self.client.files.upload,
+                        file=file_path,
                         config={"mime_type": mime_type}
                     )
                     uploaded_files.append(uploaded_file)
@@ -362,7 +404,8 @@ class GeminiService:
                 })
             user_parts.append({"text": prompt})
             
-            resp_obj = self.client.models.generate_content(
+            resp_obj = await asyncio.to_thread(
+                self.client.models.generate_content,
                 model="gemini-2.0-flash-exp",
                 contents=[
                     {"role": "user", "parts": user_parts}
@@ -404,6 +447,28 @@ class GeminiService:
             if os.path.exists(temp_dir):
                 shutil.rmtree(temp_dir)
     
+    async def extract_patient_data_coalesced(self, files_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Extract patient data from one or more files, sharing a single Gemini call between
+        identical requests that are in flight at the same time (e.g. double-submitted uploads).
+        Requests for different files are never merged, so one patient's data cannot leak into another's.
+        """
+        key = await asyncio.to_thread(_files_digest, files_data)
+        future = _inflight_extractions.get(key)
+        if future is None:
+            if len(files_data) == 1:
+                extraction = self.extract_patient_data(files_data[0]['content'], files_data[0]['type'])
+            else:
+                extraction = self.extract_patient_data_from_multiple_files(files_data)
+            future = asyncio.ensure_future(extraction)
+            _inflight_extractions[key] = future
+            future.add_done_callback(lambda _: _inflight_extractions.pop(key, None))
+        else:
+            logger.info("Joining in-flight patient extraction for identical files")
+        
+        # Shielded so one caller disconnecting does not cancel the extraction for the others
+        result = await asyncio.shield(future)
+        return copy.deepcopy(result)
+    
     def _generate_content_with_image(self, prompt: str, image: Image.Image) -> str:
         """Generate content from image using Gemini"""
         try:
@@ -678,7 +743,7 @@ class GeminiService:
         """
         
         try:
-            response = self.model.generate_content(prompt)  # type: ignore[attr-defined]
+            response = await asyncio.to_thread(self.model.generate_content, prompt)  # type: ignore[attr-defined]
             return (response.text or "")
         except Exception as e:
             logger.error(f"Error generating chat response: {str(e)}")
@@ -698,21 +763,15 @@ class GeminiService:
             file_context = await self._process_attached_files_optimized(attached_files)
         
         # Use optimized context (smaller, more focused)
-        prompt = f"""
-        You are a helpful medical assistant with access to patient data and any uploaded documents.
-        
-        Context: {context[:1500]}  
-        
-        File Data: {file_context[:2000]}
-        
-        User Question: {query}
-        
-        Please provide a concise, helpful response. Use bullet points and formatting where appropriate.
-        Keep responses focused and under 500 words unless specifically asked for detailed analysis.
-        """
+        prompt = "".join((
+            FILES_CHAT_PROMPT_HEAD, _cap(context, 1500),
+            FILES_CHAT_PROMPT_FILES, _cap(file_context, 2000),
+            FILES_CHAT_PROMPT_QUERY, query,
+            FILES_CHAT_PROMPT_TAIL
+        ))
         
         try:
-            response = self.model.generate_content(prompt)
+            response = await asyncio.to_thread(self.model.generate_content, prompt)  # type: ignore[attr-defined]
             return response.text or ""
         except Exception as e:
             logger.error(f"Error generating chat response: {str(e)}")
@@ -721,23 +780,46 @@ class GeminiService:
     async def _process_attached_files_optimized(self, files: List[Dict[str, Any]]) -> str:
         """Process attached files with optimization and caching"""
         from .chat_context_service import chat_context_service
+        from .session_store import get_session_store
         
-        context_parts = []
+        context_parts: List[Optional[str]] = []
+        pending = []
         
+        # Cache hits are resolved immediately; only misses are processed
         for file_data in files:
+            if 'summary_key' in file_data:
+                # Already resolved by the session store
+                file_id = file_data['summary_key']
+                cached_summary = file_data.get('cached_summary')
+            else:
+                file_id = chat_context_service.file_summary_key(
+                    file_data.get('file_id', str(hash(file_data.get('name', '')))), file_data.get('name')
+                )
+                cached_summary = (await get_session_store().get_cached_file_summaries([file_id]))[0]
+            context_parts.append(cached_summary or None)
+            if not cached_summary:
+                pending.append((len(context_parts) - 1, file_id, file_data))
+        
+        # Process the misses concurrently so uploads / Gemini calls overlap
+        if pending:
+            results = await asyncio.gather(*(
+                self._process_one_file_cached(file_id, file_data) for _, file_id, file_data in pending
+            ))
+            for (index, _, _), content in zip(pending, results):
+                context_parts[index] = content
+        
+        return "\n\n".join(context_parts)
+
+    async def _process_one_file_cached(self, file_id: str, file_data: Dict[str, Any]) -> str:
+        """Process a single attached file and cache its summary"""
+        from .session_store import get_session_store
+        
+        file_content = file_data.get('content')
+        file_name = file_data.get('name', 'unknown_file')
+        file_type = file_data.get('type', 'application/octet-stream')
+        
+        async with _file_processing_semaphore:
             try:
-                file_id = file_data.get('file_id', str(hash(file_data.get('name', ''))))
-                
-                # Check if we already processed this file
-                cached_summary = chat_context_service.get_cached_file_summary(file_id)
-                if cached_summary:
-                    context_parts.append(cached_summary)
-                    continue
-                
-                file_content = file_data.get('content')
-                file_name = file_data.get('name', 'unknown_file')
-                file_type = file_data.get('type', 'application/octet-stream')
-                
                 print(f"📎 Processing attached file: {file_name} ({file_type})")
                 logger.info(f"Processing attached file: {file_name} ({file_type})")
                 
@@ -756,14 +838,12 @@ class GeminiService:
                     content = f"File '{file_name}' - {file_type} - Processing available on request."
                 
                 # Cache the processed content
-                chat_context_service.cache_file_summary(file_id, content)
-                context_parts.append(content)
+                await get_session_store().cache_file_summary(file_id, content)
+                return content
                 
             except Exception as e:
                 logger.error(f"Error processing file {file_name}: {str(e)}")
-                context_parts.append(f"Error processing file '{file_name}': {str(e)}")
-        
-        return "\n\n".join(context_parts)
+                return f"Error processing file '{file_name}': {str(e)}"
 
     async def _process_excel_file_optimized(self, file_content: bytes, file_name: str) -> str:
         """Process Excel file with optimization - return summary only"""
@@ -857,7 +937,8 @@ class GeminiService:
             Focus on the most important textual information and data values.
             """
             
-            response = self._generate_content_with_image(prompt, image)
+            # Blocking SDK call runs in a thread so other files can be processed meanwhile
+            response = await asyncio.to_thread(self._generate_content_with_image, prompt, image)
             # Truncate for optimization
             if len(response) > 500:
                 response = response[:500] + "... [truncated for performance]"
@@ -876,8 +957,9 @@ class GeminiService:
             with open(pdf_path, 'wb') as f:
                 f.write(file_content)
             
-            # Upload to Gemini
-            uploaded_file = self.client.files.upload(
+            # Upload to Gemini (blocking SDK calls run in a thread so other files can be processed meanwhile)
+            uploaded_file = await asyncio.to_thread(
+                self.client.files.upload,
                 file=pdf_path,
                 config={"mime_type": "application/pdf"}
             )
@@ -890,7 +972,8 @@ class GeminiService:
             """
             
             # Generate content using uploaded file
-            resp_obj = self.client.models.generate_content(
+            resp_obj = await asyncio.to_thread(
+                self.client.models.generate_content,
                 model="gemini-2.0-flash-exp",
                 contents=[
                     {"role": "user", "parts": [
@@ -1189,3 +1272,13 @@ class GeminiService:
             return f"📝 Text File: {file_name}\nContent:\n{content_str}"
         except Exception as e:
             return f"Error processing text file '{file_name}': {str(e)}"
+
+# Global instance
+_gemini_service = None
+
+def get_gemini_service() -> GeminiService:
+    """Get or create Gemini service instance (shares its SDK clients across requests)"""
+    global _gemini_service
+    if _gemini_service is None:
+        _gemini_service = GeminiService()
+    return _gemini_service
@@ -4,17 +4,55 @@ Fallback to SQLAlchemy for local development
 """
 
 import os
+import time
+import asyncio
 import logging
-from typing import Dict, Any, List, Optional
-from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timedelta
 import uuid
 
+from sqlalchemy.orm import Session
+
+from ..utils.ttl_cache import TTLCache
+
 logger = logging.getLogger(__name__)
 
+# How long a patient list stays cached before it is fetched again
+PATIENTS_CACHE_TTL = float(os.getenv("PATIENTS_CACHE_TTL", 30))
+# How many distinct list limits are cached at once (least recently used ones are evicted)
+PATIENTS_CACHE_SIZE = int(os.getenv("PATIENTS_CACHE_SIZE", 8))
+
+def _sqlite_patient_dict(patient) -> Dict[str, Any]:
+    """Convert a SQLite patient record to the dict shape returned by Supabase"""
+    return {
+        "id": patient.id,
+        "name": patient.name,
+        "date_of_birth": patient.date_of_birth,
+        "diagnosis": patient.diagnosis,
+        "prescription": patient.prescription,
+        "created_at": patient.created_at.isoformat() if patient.created_at else None,
+        "updated_at": patient.updated_at.isoformat() if patient.updated_at else None
+    }
+
+def _postgrest_contains(search_term: str) -> str:
+    """Quote a search term as a literal `ilike` substring pattern for a PostgREST filter.
+
+    LIKE wildcards are escaped first, then the value is double-quoted (escaping `\\` and `"`)
+    so commas and parentheses cannot break or extend the filter expression.
+    """
+    pattern = search_term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    pattern = f"%{pattern}%".replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{pattern}"'
+
 class PatientService:
     """Service for patient operations with Supabase REST API"""
     
     def __init__(self):
+        # Cached get_all_patients results: limit -> (patients, expires_at). The absolute expiry keeps a
+        # frequently read list from outliving PATIENTS_CACHE_TTL, since TTLCache's own TTL slides on access
+        self._patients_cache = TTLCache(maxsize=PATIENTS_CACHE_SIZE, ttl=PATIENTS_CACHE_TTL)
+        self._patients_cache_lock = asyncio.Lock()
+        
         # Check if we should use Supabase
         self.supabase_url = os.getenv("SUPABASE_URL")
         self.supabase_key = os.getenv("SUPABASE_ANON_KEY")
@@ -51,16 +89,20 @@ class PatientService:
                 "raw_text": patient_data.get("raw_text", "")
             }
             
+            # The Supabase client and SQLAlchemy are blocking, so they run in a worker thread
             if self.db_type == "supabase":
-                return await self._create_patient_supabase(clean_data)
+                created_patient = await asyncio.to_thread(self._create_patient_supabase, clean_data)
             else:
-                return await self._create_patient_sqlite(clean_data)
+                created_patient = await asyncio.to_thread(self._create_patient_sqlite, clean_data)
+            
+            self.invalidate_cache()
+            return created_patient
                 
         except Exception as e:
             logger.error(f"Error creating patient: {str(e)}")
             raise
     
-    async def _create_patient_supabase(self, patient_data: Dict[str, Any]) -> Dict[str, Any]:
+    def _create_patient_supabase(self, patient_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create patient in Supabase"""
         try:
             # Add timestamp
@@ -79,7 +121,7 @@ class PatientService:
             logger.error(f"Supabase insert error: {str(e)}")
             raise
     
-    async def _create_patient_sqlite(self, patient_data: Dict[str, Any]) -> Dict[str, Any]:
+    def _create_patient_sqlite(self, patient_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create patient in SQLite"""
         from ..database import SessionLocal
         from ..services.database_service import DatabaseService
@@ -112,22 +154,40 @@ class PatientService:
             db.close()
     
     async def get_all_patients(self, limit: int = 100) -> List[Dict[str, Any]]:
-        """Get all patients"""
-        if self.db_type == "supabase":
-            return await self._get_patients_supabase(limit)
-        else:
-            return await self._get_patients_sqlite(limit)
+        """Get the newest patients (cached for PATIENTS_CACHE_TTL seconds per limit, for up to PATIENTS_CACHE_SIZE limits)"""
+        cached = self._patients_cache.get(limit)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        
+        # Only one request per worker refreshes the cache; the others wait for its result
+        async with self._patients_cache_lock:
+            cached = self._patients_cache.get(limit)
+            if cached and cached[1] > time.monotonic():
+                return cached[0]
+            
+            if self.db_type == "supabase":
+                patients = await asyncio.to_thread(self._get_patients_supabase, limit)
+            else:
+                patients = await asyncio.to_thread(self._get_patients_sqlite, limit)
+            
+            self._patients_cache[limit] = (patients, time.monotonic() + PATIENTS_CACHE_TTL)
+            return patients
     
-    async def _get_patients_supabase(self, limit: int) -> List[Dict[str, Any]]:
+    def invalidate_cache(self):
+        """Drop cached patient lists after a patient is created, updated or deleted"""
+        self._patients_cache.clear()
+    
+    def _get_patients_supabase(self, limit: int) -> List[Dict[str, Any]]:
         """Get patients from Supabase"""
         try:
-            result = self.supabase.table("patients").select("*").limit(limit).execute()
+            result = self.supabase.table("patients").select("*").order("created_at", desc=True).limit(limit).execute()
             return result.data if result.data else []
         except Exception as e:
+            # Raised rather than returned as an empty list so a failed fetch is never cached
             logger.error(f"Error fetching patients from Supabase: {str(e)}")
-            return []
+            raise
     
-    async def _get_patients_sqlite(self, limit: int) -> List[Dict[str, Any]]:
+    def _get_patients_sqlite(self, limit: int) -> List[Dict[str, Any]]:
         """Get patients from SQLite"""
         from ..database import SessionLocal
         from ..services.database_service import DatabaseService
@@ -135,39 +195,161 @@ class PatientService:
         db = SessionLocal()
         try:
             db_service = DatabaseService(db)
-            patients = db_service.get_all_patients()
+            patients = db_service.get_all_patients(limit)
             
-            return [
-                {
-                    "id": p.id,
-                    "name": p.name,
-                    "date_of_birth": p.date_of_birth,
-                    "diagnosis": p.diagnosis,
-                    "prescription": p.prescription,
-                    "created_at": p.created_at.isoformat() if p.created_at else None
-                }
-                for p in patients[:limit]
-            ]
+            return [_sqlite_patient_dict(p) for p in patients]
+        finally:
+            db.close()
+    
+    async def get_patient_by_id(self, patient_id: Any) -> Optional[Dict[str, Any]]:
+        """Get a single patient by ID"""
+        if self.db_type == "supabase":
+            return await asyncio.to_thread(self._get_patient_by_id_supabase, patient_id)
+        return await asyncio.to_thread(self._get_patient_by_id_sqlite, patient_id)
+    
+    def _get_patient_by_id_supabase(self, patient_id: Any) -> Optional[Dict[str, Any]]:
+        """Get patient by ID from Supabase"""
+        result = self.supabase.table("patients").select("*").eq("id", patient_id).limit(1).execute()
+        return result.data[0] if result.data else None
+    
+    def _get_patient_by_id_sqlite(self, patient_id: Any) -> Optional[Dict[str, Any]]:
+        """Get patient by ID from SQLite"""
+        from ..database import SessionLocal
+        from ..services.database_service import DatabaseService
+        
+        db = SessionLocal()
+        try:
+            patient = DatabaseService(db).get_patient_by_id(str(patient_id))
+            return _sqlite_patient_dict(patient) if patient else None
+        finally:
+            db.close()
+    
+    async def search_patients(self, search_term: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Get the newest patients whose name or diagnosis contains the search term"""
+        if self.db_type == "supabase":
+            return await asyncio.to_thread(self._search_patients_supabase, search_term, limit)
+        return await asyncio.to_thread(self._search_patients_sqlite, search_term, limit)
+    
+    def _search_patients_supabase(self, search_term: str, limit: int) -> List[Dict[str, Any]]:
+        """Search patients in Supabase"""
+        pattern = _postgrest_contains(search_term)
+        result = self.supabase.table("patients").select("*").or_(
+            f"name.ilike.{pattern},diagnosis.ilike.{pattern}"
+        ).order("created_at", desc=True).limit(limit).execute()
+        return result.data if result.data else []
+    
+    def _search_patients_sqlite(self, search_term: str, limit: int) -> List[Dict[str, Any]]:
+        """Search patients in SQLite"""
+        from ..database import SessionLocal
+        from ..services.database_service import DatabaseService
+        
+        db = SessionLocal()
+        try:
+            db_service = DatabaseService(db)
+            return [_sqlite_patient_dict(p) for p in db_service.search_patients(search_term, limit)]
         finally:
             db.close()
     
+    async def get_patients_stats(self) -> Dict[str, Any]:
+        """Get the total patient count and how many were added in the last 7 days"""
+        week_ago = datetime.utcnow() - timedelta(days=7)
+        if self.db_type == "supabase":
+            total_count, recent_count = await asyncio.to_thread(self._count_patients_supabase, week_ago)
+        else:
+            total_count, recent_count = await asyncio.to_thread(self._count_patients_sqlite, week_ago)
+        
+        return {
+            "total_patients": total_count,
+            "recent_patients": recent_count,
+            "last_updated": datetime.utcnow().isoformat()
+        }
+    
+    def _count_patients_supabase(self, since: datetime) -> Tuple[int, int]:
+        """Count all patients and those created since `since` in Supabase"""
+        total = self.supabase.table("patients").select("id", count="exact").limit(1).execute()
+        recent = self.supabase.table("patients").select("id", count="exact").gte("created_at", since.isoformat()).limit(1).execute()
+        return total.count or 0, recent.count or 0
+    
+    def _count_patients_sqlite(self, since: datetime) -> Tuple[int, int]:
+        """Count all patients and those created since `since` in SQLite"""
+        from ..database import SessionLocal
+        from ..services.database_service import DatabaseService
+        
+        db = SessionLocal()
+        try:
+            db_service = DatabaseService(db)
+            return db_service.count_patients(), db_service.count_patients(created_since=since)
+        finally:
+            db.close()
+    
+    async def update_patient(self, patient_id: Any, update_data: Dict[str, Any], db: Session) -> Optional[Dict[str, Any]]:
+        """Update a patient's editable fields; `db` is the request session used by the SQLite fallback"""
+        if self.db_type == "supabase":
+            updated_patient = await asyncio.to_thread(self._update_patient_supabase, patient_id, update_data)
+        else:
+            updated_patient = await asyncio.to_thread(self._update_patient_sqlite, db, patient_id, update_data)
+        
+        if updated_patient:
+            self.invalidate_cache()
+        return updated_patient
+    
+    async def delete_patient(self, patient_id: Any, db: Session) -> bool:
+        """Delete a patient; `db` is the request session used by the SQLite fallback"""
+        if self.db_type == "supabase":
+            deleted = await asyncio.to_thread(self._delete_patient_supabase, patient_id)
+        else:
+            deleted = await asyncio.to_thread(self._delete_patient_sqlite, db, patient_id)
+        
+        if deleted:
+            self.invalidate_cache()
+        return deleted
+    
+    def _update_patient_supabase(self, patient_id: Any, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Update patient in Supabase"""
+        update_data = {**update_data, "updated_at": datetime.utcnow().isoformat()}
+        result = self.supabase.table("patients").update(update_data).eq("id", patient_id).execute()
+        return result.data[0] if result.data else None
+    
+    def _update_patient_sqlite(self, db: Session, patient_id: Any, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Update patient in SQLite"""
+        from ..models.patient import PatientUpdate
+        from ..services.database_service import DatabaseService
+        
+        updated_patient = DatabaseService(db).update_patient(str(patient_id), PatientUpdate(**update_data))
+        return _sqlite_patient_dict(updated_patient) if updated_patient else None
+    
+    def _delete_patient_supabase(self, patient_id: Any) -> bool:
+        """Delete patient from Supabase"""
+        result = self.supabase.table("patients").delete().eq("id", patient_id).execute()
+        return bool(result.data)
+    
+    def _delete_patient_sqlite(self, db: Session, patient_id: Any) -> bool:
+        """Delete patient from SQLite"""
+        from ..services.database_service import DatabaseService
+        
+        return DatabaseService(db).delete_patient(str(patient_id))
+    
     async def test_connection(self) -> bool:
         """Test database connection"""
         try:
-            if self.db_type == "supabase":
-                result = self.supabase.table("patients").select("id").limit(1).execute()
-                return True
-            else:
-                from ..database import SessionLocal
-                db = SessionLocal()
-                try:
-                    db.execute("SELECT 1")
-                    return True
-                finally:
-                    db.close()
+            await asyncio.to_thread(self._ping)
+            return True
         except Exception as e:
             logger.error(f"Connection test failed: {str(e)}")
             return False
+    
+    def _ping(self):
+        """Run a trivial query against the active backend (blocking)"""
+        if self.db_type == "supabase":
+            self.supabase.table("patients").select("id").limit(1).execute()
+        else:
+            from sqlalchemy import text
+            from ..database import SessionLocal
+            db = SessionLocal()
+            try:
+                db.execute(text("SELECT 1"))
+            finally:
+                db.close()
 
 # Global instance
 _patient_service = None
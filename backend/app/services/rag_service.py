@@ -1,6 +1,6 @@
 import chromadb
 from chromadb.config import Settings
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import os
 try:
     from sentence_transformers import SentenceTransformer
@@ -9,7 +9,9 @@ except ImportError:
 import numpy as np
 from app.services.database_service import DatabaseService
 from app.database import SessionLocal
-from app.services.gemini_service import GeminiService
+from app.services.gemini_service import get_gemini_service
+from app.services.chat_context_service import SESSION_TTL_SECONDS, MAX_SESSIONS
+from app.utils.ttl_cache import TTLCache
 import logging
 from datetime import datetime
 import uuid
@@ -24,6 +26,9 @@ except Exception:
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on rendered patient texts kept for the SQL fallback search
+PATIENT_TEXT_CACHE_SIZE = int(os.getenv("PATIENT_TEXT_CACHE_SIZE", 2048))
+
 class RAGService:
     def __init__(self):
         self.persist_dir = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
@@ -64,7 +69,11 @@ class RAGService:
                 logger.warning("GEMINI_API_KEY not set; remote embedding fallback disabled")
         if self.encoder is None and self.remote_embedder is None:
             logger.warning("No embedding provider available. RAG functionality will be limited.")
-        self.gemini_service = GeminiService()
+        self.gemini_service = get_gemini_service()
+        # Attached-file context per chat session, bounded and expired like the chat sessions themselves
+        self.chat_contexts = TTLCache(maxsize=MAX_SESSIONS, ttl=SESSION_TTL_SECONDS)
+        # Rendered search text per patient, keyed by (id, updated_at) so edits produce a fresh entry
+        self._fmt_cache = TTLCache(maxsize=PATIENT_TEXT_CACHE_SIZE, ttl=SESSION_TTL_SECONDS)
     
     def _chunk_text(self, text: str, chunk_size: int = 800, overlap: int = 100) -> List[str]:
         safe_text = re.sub(r"[\x00-\x08\x0b\x0c\x0e-\x1f]", " ", text or "").strip()
@@ -107,19 +116,38 @@ class RAGService:
         raise RuntimeError("Encoder not available")
     
     def _create_patient_text(self, patient_data: Dict[str, Any], raw_text: Optional[str] = None) -> str:
+        # Look each field up once; this runs for every patient on indexing and SQL fallback search
+        get = patient_data.get
+        name, date_of_birth = get("name"), get("date_of_birth")
+        diagnosis, prescription = get("diagnosis"), get("prescription")
         parts: List[str] = []
-        if patient_data.get("name"):
-            parts.append(f"Patient Name: {patient_data['name']}")
-        if patient_data.get("date_of_birth"):
-            parts.append(f"Date of Birth: {patient_data['date_of_birth']}")
-        if patient_data.get("diagnosis"):
-            parts.append(f"Diagnosis: {patient_data['diagnosis']}")
-        if patient_data.get("prescription"):
-            parts.append(f"Prescription: {patient_data['prescription']}")
+        if name:
+            parts.append(f"Patient Name: {name}")
+        if date_of_birth:
+            parts.append(f"Date of Birth: {date_of_birth}")
+        if diagnosis:
+            parts.append(f"Diagnosis: {diagnosis}")
+        if prescription:
+            parts.append(f"Prescription: {prescription}")
         if raw_text:
             parts.append(f"Details: {raw_text}")
         return " | ".join(parts)
 
+    def _patient_search_text(self, patient) -> Tuple[str, str]:
+        """Get (lowercased haystack, display text) for a DB patient row, memoized until the row changes"""
+        key = (patient.id, patient.updated_at)
+        cached = self._fmt_cache.get(key)
+        if cached is None:
+            haystack = " ".join(filter(None, [patient.name, patient.date_of_birth, patient.diagnosis or "", patient.prescription or ""]))
+            cached = self._fmt_cache[key] = (haystack.lower(), self._create_patient_text({
+                "name": patient.name,
+                "date_of_birth": patient.date_of_birth,
+                "diagnosis": patient.diagnosis,
+                "prescription": patient.prescription,
+                "id": patient.id
+            }))
+        return cached
+
     def _sanitize_metadata(self, metadata: Dict[str, Any]) -> Dict[str, Any]:
         sanitized: Dict[str, Any] = {}
         for k, v in (metadata or {}).items():
@@ -237,17 +265,11 @@ class RAGService:
             q = query.lower()
             scored: List[Dict[str, Any]] = []
             for p in all_patients:
-                hay = " ".join(filter(None, [p.name, p.date_of_birth, p.diagnosis or "", p.prescription or ""]))
-                score = 1.0 if q in hay.lower() else 0.0
+                hay, content = self._patient_search_text(p)
+                score = 1.0 if q in hay else 0.0
                 if score > 0.0:
                     scored.append({
-                        "content": self._create_patient_text({
-                            "name": p.name,
-                            "date_of_birth": p.date_of_birth,
-                            "diagnosis": p.diagnosis,
-                            "prescription": p.prescription,
-                            "id": p.id
-                        }),
+                        "content": content,
                         "metadata": {"patient_id": p.id, "name": p.name, "type": "patient_record"},
                         "similarity_score": score
                     })
@@ -326,28 +348,28 @@ class RAGService:
             # Create a document ID for this attachment
             attachment_id = f"chat_{chat_session_id}_attachment_{metadata.get('filename', 'unknown')}"
             
+            added_at = datetime.now().isoformat()
+            
             # Store in session context (completely separate from RAG database)
             # This is for attached files only, not for general document retrieval
-            if not hasattr(self, 'chat_contexts'):
-                self.chat_contexts = {}
-            
-            if chat_session_id not in self.chat_contexts:
-                self.chat_contexts[chat_session_id] = {
+            session_context = self.chat_contexts.get(chat_session_id)
+            if session_context is None:
+                session_context = self.chat_contexts[chat_session_id] = {
                     "attachments": [],
                     "attached_files_context": "",  # Separate context for attached files
-                    "created_at": datetime.now().isoformat()
+                    "created_at": added_at
                 }
             
             # Add attachment to session context
-            self.chat_contexts[chat_session_id]["attachments"].append({
+            session_context["attachments"].append({
                 "attachment_id": attachment_id,
                 "content": content,
                 "metadata": metadata,
-                "added_at": datetime.now().isoformat()
+                "added_at": added_at
             })
             
             # Update ONLY the attached files context (not RAG database)
-            self.chat_contexts[chat_session_id]["attached_files_context"] += f"\n\n--- ATTACHED FILE: {metadata.get('filename')} ---\n{content}"
+            session_context["attached_files_context"] += f"\n\n--- ATTACHED FILE: {metadata.get('filename')} ---\n{content}"
             
             print(f"Added attachment to chat session {chat_session_id} (separate from RAG database)")
             
@@ -358,13 +380,11 @@ class RAGService:
     async def get_chat_attachments(self, chat_session_id: str) -> List[dict]:
         """Get all attachments for a chat session"""
         try:
-            if not hasattr(self, 'chat_contexts'):
-                self.chat_contexts = {}
-            
-            if chat_session_id not in self.chat_contexts:
+            session_context = self.chat_contexts.get(chat_session_id)
+            if session_context is None:
                 return []
             
-            return self.chat_contexts[chat_session_id].get("attachments", [])
+            return session_context.get("attachments", [])
         
         except Exception as e:
             print(f"Error retrieving chat attachments: {str(e)}")
@@ -373,14 +393,12 @@ class RAGService:
     def get_chat_context(self, chat_session_id: str) -> str:
         """Get ONLY the attached files context (not RAG database context)"""
         try:
-            if not hasattr(self, 'chat_contexts'):
-                self.chat_contexts = {}
-            
-            if chat_session_id not in self.chat_contexts:
+            session_context = self.chat_contexts.get(chat_session_id)
+            if session_context is None:
                 return ""
             
             # Return only attached files context, not RAG database context
-            return self.chat_contexts[chat_session_id].get("attached_files_context", "")
+            return session_context.get("attached_files_context", "")
         
         except Exception as e:
             print(f"Error retrieving chat context: {str(e)}")
@@ -409,3 +427,13 @@ class RAGService:
             chunks.append(" ".join(current_chunk))
         
         return chunks
+
+# Global instance
+_rag_service = None
+
+def get_rag_service() -> RAGService:
+    """Get or create RAG service instance (loads the embedding model and Chroma client once)"""
+    global _rag_service
+    if _rag_service is None:
+        _rag_service = RAGService()
+    return _rag_service
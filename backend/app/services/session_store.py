@@ -0,0 +1,539 @@
+"""
+Chat Session Store with Redis Integration
+Fallback to the in-process ChatContextService for local development
+"""
+
+import os
+import asyncio
+import json
+import time
+import zlib
+import gzip
+import uuid
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import aiofiles
+from fastapi import UploadFile
+
+try:
+    from blake3 import blake3 as content_hash
+except ImportError:
+    content_hash = hashlib.sha256
+
+from .chat_context_service import chat_context_service, SESSION_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Uploaded chat files are spooled here (one file per content digest) for the in-memory backend
+CHAT_SPOOL_DIR = Path(os.getenv("CHAT_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "chat_spool")))
+
+# Uploads are streamed into storage in chunks of this size rather than read whole
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Text-like uploads larger than this are stored gzip-compressed
+UPLOAD_COMPRESS_MIN_BYTES = 64 * 1024
+UPLOAD_COMPRESS_LEVEL = 3
+COMPRESSIBLE_TYPES = ("application/json", "application/xml")
+
+def _should_compress(content_type: Optional[str], first_chunk_size: int) -> bool:
+    """Check whether an upload is worth storing compressed"""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    is_text = content_type.startswith("text/") or content_type in COMPRESSIBLE_TYPES
+    return is_text and first_chunk_size > UPLOAD_COMPRESS_MIN_BYTES
+
+# Appends a message only while the session hash exists, so a session cleared mid-request is never
+# recreated as a partial hash. KEYS: session hash, messages list, files list.
+# ARGV: message JSON, TTL, number of trailing messages to return, session fields to return (read before the append)
+_APPEND_MESSAGE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local fields = {}
+if #ARGV > 3 then
+    fields = redis.call('HMGET', KEYS[1], unpack(ARGV, 4))
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('HINCRBY', KEYS[1], 'n_msgs', 1)
+for _, key in ipairs(KEYS) do
+    redis.call('EXPIRE', key, ARGV[2])
+end
+local tail = {}
+local count = tonumber(ARGV[3])
+if count > 0 then
+    tail = redis.call('LRANGE', KEYS[2], -count, -1)
+end
+return {fields, tail}
+"""
+
+# Sets the context summary only while the session hash exists. KEYS: session hash. ARGV: summary, TTL
+_SET_SUMMARY_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'context_summary', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# Reserves upload bytes against a session's file budget in one atomic step, only while the session exists.
+# KEYS: session hash. ARGV: bytes to reserve (-1 for all that is left), budget.
+# Returns the bytes reserved, -1 if they do not fit, or nil if the session does not exist
+_RESERVE_BYTES_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local remaining = tonumber(ARGV[2]) - tonumber(redis.call('HGET', KEYS[1], 'files_bytes') or 0)
+local nbytes = tonumber(ARGV[1])
+if nbytes < 0 then
+    nbytes = math.max(remaining, 0)
+end
+if nbytes > remaining then
+    return -1
+end
+redis.call('HINCRBY', KEYS[1], 'files_bytes', nbytes)
+return nbytes
+"""
+
+# Returns unused reserved bytes, only while the session exists. KEYS: session hash. ARGV: bytes
+_RELEASE_BYTES_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HINCRBY', KEYS[1], 'files_bytes', -tonumber(ARGV[1]))
+end
+return 0
+"""
+
+class SessionStore:
+    """Service for chat session storage shared across workers via Redis"""
+
+    def __init__(self):
+        # Check if we should use Redis
+        self.redis_url = os.getenv("REDIS_URL")
+
+        if self.redis_url:
+            try:
+                import redis.asyncio as redis
+                self.redis = redis.Redis.from_url(self.redis_url)
+                self._append_message_script = self.redis.register_script(_APPEND_MESSAGE_LUA)
+                self._set_summary_script = self.redis.register_script(_SET_SUMMARY_LUA)
+                self._reserve_bytes_script = self.redis.register_script(_RESERVE_BYTES_LUA)
+                self._release_bytes_script = self.redis.register_script(_RELEASE_BYTES_LUA)
+                self.backend = "redis"
+                print("✅ Using Redis for chat session storage")
+            except ImportError:
+                print("⚠️ Redis client not installed, falling back to in-memory sessions")
+                self.backend = "memory"
+        else:
+            print("📁 Using in-memory chat session storage")
+            self.backend = "memory"
+
+        if self.backend == "memory":
+            CHAT_SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _key(session_id: str, suffix: str = "") -> str:
+        """Build the Redis key for a session (or one of its sub-keys)"""
+        return f"sess:{session_id}{suffix}"
+
+    @staticmethod
+    def _blob_key(file_id: str, encoding: Optional[str] = None) -> str:
+        """Build the Redis key for content-addressed file bytes"""
+        return f"blob:{file_id}:gz" if encoding == "gzip" else f"blob:{file_id}"
+
+    @staticmethod
+    def _summary_key(summary_key: str) -> str:
+        """Build the Redis key for a processed file summary"""
+        return f"summary:{summary_key}"
+
+    @staticmethod
+    def _spool_path(file_id: str, encoding: Optional[str] = None) -> Path:
+        """Path of the spooled bytes for a content digest"""
+        return CHAT_SPOOL_DIR / (f"{file_id}.gz" if encoding == "gzip" else file_id)
+
+    async def _spool_read(self, file_id: str, encoding: Optional[str] = None) -> bytes:
+        """Read spooled file bytes (empty if the spool file was cleaned up)"""
+        path = self._spool_path(file_id, encoding)
+        try:
+            async with aiofiles.open(path, "rb") as f:
+                return await f.read()
+        except FileNotFoundError:
+            logger.warning(f"Spooled file {file_id} no longer available")
+            return b""
+
+    def _touch_spool(self, files: List[Dict[str, Any]]):
+        """Refresh the mtime of every spool file a session references (blocking)"""
+        for file_info in files:
+            try:
+                os.utime(self._spool_path(file_info['file_id'], file_info.get('encoding')))
+            except FileNotFoundError:
+                pass
+
+    def _queue_touch(self, pipe, session_id: str, *extra_keys: str):
+        """Queue TTL refreshes for all keys belonging to a session on a pipeline"""
+        for key in (self._key(session_id), self._key(session_id, ":msgs"), self._key(session_id, ":files"), *extra_keys):
+            pipe.expire(key, SESSION_TTL_SECONDS)
+
+    async def _touch(self, session_id: str, *extra_keys: str):
+        """Refresh the TTL on all keys belonging to a session"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            self._queue_touch(pipe, session_id, *extra_keys)
+            await pipe.execute()
+
+    async def _append_message(self, session_id: str, message: str, role: str,
+                              fields: Optional[List[str]] = None, tail: int = 0) -> Optional[List[Any]]:
+        """Append a message, bump its counter and refresh the session TTLs in one guarded round trip.
+
+        Returns [values of `fields` before the append, last `tail` raw messages], or None
+        (with nothing written) if the session does not exist.
+        """
+        keys = [self._key(session_id), self._key(session_id, ":msgs"), self._key(session_id, ":files")]
+        payload = json.dumps({
+            'role': role,
+            'content': message,
+            'ts_ns': time.time_ns()
+        })
+        return await self._append_message_script(keys=keys, args=[payload, SESSION_TTL_SECONDS, tail, *(fields or [])])
+
+    async def _set_summary(self, session_id: str, summary: str) -> bool:
+        """Set the context summary (refreshing the hash TTL) only if the session still exists"""
+        return bool(await self._set_summary_script(keys=[self._key(session_id)], args=[summary, SESSION_TTL_SECONDS]))
+
+    async def create_session(self, session_id: Optional[str] = None) -> str:
+        """Create a new chat session and return session ID"""
+        if self.backend != "redis":
+            return chat_context_service.create_session(session_id)
+
+        session_id = session_id or str(uuid.uuid4())
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(self._key(session_id), mapping={
+                'session_id': session_id,
+                'created_at_ns': time.time_ns(),
+                'n_msgs': 0,
+                'n_files': 0,
+                'files_bytes': 0,
+                'context_summary': ""
+            })
+            pipe.expire(self._key(session_id), SESSION_TTL_SECONDS)
+            await pipe.execute()
+        return session_id
+
+    async def exists(self, session_id: str) -> bool:
+        """Check whether a session exists"""
+        if self.backend != "redis":
+            return chat_context_service.get_context(session_id) is not None
+
+        return bool(await self.redis.exists(self._key(session_id)))
+
+    async def get_context(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Get full context for a chat session"""
+        if self.backend != "redis":
+            return chat_context_service.get_context(session_id)
+
+        data = await self.redis.hgetall(self._key(session_id))
+        if not data:
+            return None
+
+        data = {k.decode(): v.decode() for k, v in data.items()}
+        raw_messages = await self.redis.lrange(self._key(session_id, ":msgs"), 0, -1)
+        return {
+            'session_id': data.get('session_id', session_id),
+            'created_at_ns': int(data.get('created_at_ns', 0)),
+            'messages': [json.loads(m) for m in raw_messages],
+            'context_summary': data.get('context_summary', "")
+        }
+
+    async def add_message(self, session_id: str, message: str, role: str = 'user') -> bool:
+        """Add a message to the chat session"""
+        if self.backend != "redis":
+            return chat_context_service.add_message(session_id, message, role)
+
+        return await self._append_message(session_id, message, role) is not None
+
+    async def add_message_and_get_fields(self, session_id: str, message: str, role: str,
+                                         fields: List[str]) -> Optional[Dict[str, Optional[str]]]:
+        """Add a message and return the given session fields as they were before it, in one round trip.
+
+        Returns None if the session does not exist.
+        """
+        if self.backend != "redis":
+            context = chat_context_service.get_context(session_id)
+            if context is None:
+                return None
+            values = {field: context.get(field) for field in fields}
+            chat_context_service.add_message(session_id, message, role)
+            return values
+
+        result = await self._append_message(session_id, message, role, fields=fields)
+        if result is None:
+            return None
+        return {field: value.decode() if value is not None else None for field, value in zip(fields, result[0])}
+
+    async def add_reply(self, session_id: str, message: str, summary_count: int = 10) -> bool:
+        """Add an assistant reply and rebuild the context summary from the last `summary_count` messages"""
+        if self.backend != "redis":
+            if not chat_context_service.add_message(session_id, message, 'assistant'):
+                return False
+            messages = chat_context_service.get_recent_messages(session_id, summary_count)
+            return chat_context_service.update_context_summary(session_id, _summarize(messages))
+
+        # The reply is appended and the recent tail read back in the same round trip. Both writes
+        # are skipped if the session was cleared while the reply was being generated
+        result = await self._append_message(session_id, message, 'assistant', tail=summary_count)
+        if result is None:
+            return False
+
+        messages = [json.loads(m) for m in result[1]]
+        return await self._set_summary(session_id, _summarize(messages))
+
+    async def get_recent_messages(self, session_id: str, count: int) -> List[Dict[str, Any]]:
+        """Get the last `count` messages for a session"""
+        if self.backend != "redis":
+            return chat_context_service.get_recent_messages(session_id, count)
+
+        raw_messages = await self.redis.lrange(self._key(session_id, ":msgs"), -count, -1)
+        return [json.loads(m) for m in raw_messages]
+
+    async def _stored_chunks(self, upload: UploadFile, max_bytes: int, digest, stored: Dict[str, Any]):
+        """Yield the bytes to store for an upload, hashing and size-checking the raw body on the way"""
+        compressor = None
+        size = 0
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            # A first chunk shorter than the threshold means the whole upload is small
+            if size == 0 and _should_compress(upload.content_type, len(chunk)):
+                compressor = zlib.compressobj(UPLOAD_COMPRESS_LEVEL, zlib.DEFLATED, 31)
+                stored['encoding'] = "gzip"
+            size += len(chunk)
+            if size > max_bytes:
+                raise ValueError(f"Upload exceeds {max_bytes} bytes")
+            digest.update(chunk)
+            yield compressor.compress(chunk) if compressor else chunk
+        if compressor:
+            yield compressor.flush()
+        stored['size'] = size
+
+    async def store_upload(self, upload: UploadFile, max_bytes: int) -> Dict[str, Any]:
+        """Stream an upload into content-addressed storage.
+
+        The body is hashed while it is copied in chunks, so only one chunk is held in
+        memory at a time. Large text uploads are gzip-compressed on the way in.
+        Returns the stored file's 'file_id', 'size' and 'encoding'; raises ValueError
+        once more than max_bytes have been read.
+        """
+        digest = content_hash()
+        stored: Dict[str, Any] = {'size': 0, 'encoding': None}
+
+        if self.backend != "redis":
+            tmp_path = CHAT_SPOOL_DIR / f".upload-{uuid.uuid4().hex}"
+            try:
+                async with aiofiles.open(tmp_path, "wb") as out:
+                    async for chunk in self._stored_chunks(upload, max_bytes, digest, stored):
+                        await out.write(chunk)
+
+                # Bytes are stored once per content digest and shared by every session that uploads them
+                stored['file_id'] = digest.hexdigest()
+                path = self._spool_path(stored['file_id'], stored['encoding'])
+                if path.exists():
+                    os.utime(path)  # Keep a re-uploaded file from being cleaned up
+                elif stored['size']:
+                    os.replace(tmp_path, path)  # Empty uploads are rejected by the caller, so never spooled
+            finally:
+                tmp_path.unlink(missing_ok=True)
+            return stored
+
+        tmp_key = f"upload:{uuid.uuid4().hex}"
+        try:
+            async for chunk in self._stored_chunks(upload, max_bytes, digest, stored):
+                if not chunk:
+                    continue
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.append(tmp_key, chunk)
+                    pipe.expire(tmp_key, SESSION_TTL_SECONDS)
+                    await pipe.execute()
+
+            stored['file_id'] = digest.hexdigest()
+            blob_key = self._blob_key(stored['file_id'], stored['encoding'])
+            if await self.redis.exists(blob_key):
+                await self.redis.expire(blob_key, SESSION_TTL_SECONDS)
+            elif stored['size']:
+                await self.redis.rename(tmp_key, blob_key)
+        finally:
+            await self.redis.delete(tmp_key)
+        return stored
+
+    async def add_attached_file(self, session_id: str, file_data: Dict[str, Any]) -> bool:
+        """Add an attached file (already stored via store_upload, its bytes reserved via reserve_file_bytes)"""
+        if not await self.exists(session_id):
+            return False
+
+        if self.backend != "redis":
+            return chat_context_service.add_attached_file(session_id, file_data)
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.rpush(self._key(session_id, ":files"), json.dumps({
+                'file_id': file_data['file_id'],
+                'name': file_data.get('name'),
+                'type': file_data.get('type'),
+                'size': file_data['size'],
+                'encoding': file_data.get('encoding'),
+                'uploaded_at_ns': time.time_ns()
+            }))
+            pipe.hincrby(self._key(session_id), 'n_files', 1)
+            self._queue_touch(pipe, session_id)
+            await pipe.execute()
+        return True
+
+    async def reserve_file_bytes(self, session_id: str, nbytes: Optional[int], limit: int) -> Optional[int]:
+        """Atomically reserve upload bytes against a session's file budget before the upload is stored.
+
+        Reserves all that is left of the budget when nbytes is None. Returns the bytes reserved,
+        or None if the session does not exist; raises ValueError if they do not fit.
+        """
+        if self.backend != "redis":
+            return chat_context_service.reserve_file_bytes(session_id, nbytes, limit)
+
+        reserved = await self._reserve_bytes_script(
+            keys=[self._key(session_id)],
+            args=[-1 if nbytes is None else nbytes, limit]
+        )
+        if reserved is None:
+            return None
+        if reserved < 0:
+            raise ValueError(f"Session file budget of {limit} bytes exceeded")
+        return reserved
+
+    async def release_file_bytes(self, session_id: str, nbytes: int):
+        """Return reserved upload bytes that were not used (failed or smaller upload) to the budget"""
+        if self.backend != "redis":
+            return chat_context_service.release_file_bytes(session_id, nbytes)
+
+        await self._release_bytes_script(keys=[self._key(session_id)], args=[nbytes])
+
+    async def get_attached_files(self, session_id: str, load_content: bool = True) -> List[Dict[str, Any]]:
+        """Get all attached files for a session.
+
+        Content is only loaded for files whose processed summary is not cached yet;
+        the others are returned with empty content and their 'cached_summary'.
+        """
+        if self.backend != "redis":
+            files = chat_context_service.get_attached_files(session_id)
+        else:
+            files = [json.loads(f) for f in await self.redis.lrange(self._key(session_id, ":files"), 0, -1)]
+        if not files or not load_content:
+            return files
+
+        # The summary keys and lookups are resolved once here and reused by the file processor
+        for file_info in files:
+            file_info['content'] = b""
+            file_info['summary_key'] = chat_context_service.file_summary_key(file_info['file_id'], file_info.get('name'))
+        summaries = await self.get_cached_file_summaries([f['summary_key'] for f in files])
+        for file_info, summary in zip(files, summaries):
+            file_info['cached_summary'] = summary
+        needed = [f for f in files if f['cached_summary'] is None]
+
+        if self.backend != "redis":
+            for file_info in needed:
+                content = await self._spool_read(file_info['file_id'], file_info.get('encoding'))
+                file_info['content'] = await _decode(content, file_info.get('encoding'))
+            # The janitor deletes spool files by mtime, so keep every file of an active session
+            # fresh, including those whose summary is cached and are no longer read
+            await asyncio.to_thread(self._touch_spool, files)
+            return files
+
+        blob_keys = [self._blob_key(f['file_id'], f.get('encoding')) for f in files]
+        if needed:
+            contents = await self.redis.mget([self._blob_key(f['file_id'], f.get('encoding')) for f in needed])
+            for file_info, content in zip(needed, contents):
+                file_info['content'] = await _decode(content or b"", file_info.get('encoding'))
+
+        await self._touch(session_id, *blob_keys)
+        return files
+
+    async def get_cached_file_summaries(self, summary_keys: List[str]) -> List[Optional[str]]:
+        """Get cached processed summaries (None where missing) for several files at once"""
+        if self.backend != "redis":
+            return [chat_context_service.get_cached_file_summary(key) for key in summary_keys]
+        if not summary_keys:
+            return []
+
+        # Summaries are shared by every worker, so a file processed on one is a hit on all
+        values = await self.redis.mget([self._summary_key(key) for key in summary_keys])
+        return [value.decode() if value is not None else None for value in values]
+
+    async def cache_file_summary(self, summary_key: str, summary: str):
+        """Cache a processed file summary"""
+        if self.backend != "redis":
+            chat_context_service.cache_file_summary(summary_key, summary)
+            return
+
+        await self.redis.set(self._summary_key(summary_key), summary, ex=SESSION_TTL_SECONDS)
+
+    async def update_context_summary(self, session_id: str, summary: str) -> bool:
+        """Update the context summary for a session"""
+        if self.backend != "redis":
+            return chat_context_service.update_context_summary(session_id, summary)
+
+        return await self._set_summary(session_id, summary)
+
+    async def get_session_list(self) -> List[Dict[str, Any]]:
+        """Get list of all chat sessions"""
+        if self.backend != "redis":
+            return chat_context_service.get_session_list()
+
+        keys = [key async for key in self.redis.scan_iter(match="sess:*", _type="hash")]
+        if not keys:
+            return []
+
+        # Counts come from the running counters on each session hash, fetched in one round trip
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hmget(key, 'created_at_ns', 'n_msgs', 'n_files')
+            rows = await pipe.execute()
+
+        return [
+            {
+                'session_id': key.decode()[len("sess:"):],
+                'created_at': int(created_at_ns or 0) / 1e9,
+                'message_count': int(n_msgs or 0),
+                'file_count': int(n_files or 0)
+            }
+            for key, (created_at_ns, n_msgs, n_files) in zip(keys, rows)
+        ]
+
+    async def clear_session(self, session_id: str) -> bool:
+        """Clear a chat session"""
+        if self.backend != "redis":
+            return chat_context_service.clear_session(session_id)
+
+        if not await self.exists(session_id):
+            return False
+
+        # Shared file blobs are left to expire on their own TTL
+        await self.redis.delete(
+            self._key(session_id),
+            self._key(session_id, ":msgs"),
+            self._key(session_id, ":files")
+        )
+        return True
+
+async def _decode(content: bytes, encoding: Optional[str]) -> bytes:
+    """Undo the storage encoding applied by store_upload (off the event loop, files can be tens of MB)"""
+    if encoding == "gzip" and content:
+        return await asyncio.to_thread(gzip.decompress, content)
+    return content
+
+def _summarize(messages: List[Dict[str, Any]]) -> str:
+    """Render messages as the plain-text context summary fed back to the model"""
+    return "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
+
+# Global instance
+_session_store = None
+
+def get_session_store() -> SessionStore:
+    """Get or create session store instance"""
+    global _session_store
+    if _session_store is None:
+        _session_store = SessionStore()
+    return _session_store
@@ -32,8 +32,9 @@ class SupabaseService:
         """Create a new patient record"""
         try:
             # Add timestamps
-            patient_data["created_at"] = datetime.now().isoformat()
-            patient_data["updated_at"] = datetime.now().isoformat()
+            now = datetime.now().isoformat()
+            patient_data["created_at"] = now
+            patient_data["updated_at"] = now
             
             # Insert via REST API
             response = self.supabase.table('patients').insert(patient_data).execute()
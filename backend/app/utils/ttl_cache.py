@@ -0,0 +1,73 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, List, Tuple
+
+class TTLCache:
+    """In-memory mapping bounded by entry count (LRU eviction) and idle time (TTL)"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (value, expires_at); ordered from least to most recently used
+        self._data: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+
+    def _is_live(self, key: Hashable) -> bool:
+        """Check that a key is present and not expired, dropping it if it is"""
+        item = self._data.get(key)
+        if item is None:
+            return False
+        if item[1] <= time.monotonic():
+            del self._data[key]
+            return False
+        return True
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._is_live(key)
+
+    def __getitem__(self, key: Hashable) -> Any:
+        if not self._is_live(key):
+            raise KeyError(key)
+        # Touch the entry: extend its TTL and mark it most recently used
+        value = self._data[key][0]
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __delitem__(self, key: Hashable):
+        del self._data[key]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def clear(self):
+        self._data.clear()
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Snapshot of live entries (does not touch them)"""
+        self.expire()
+        return [(key, value) for key, (value, _) in self._data.items()]
+
+    def expire(self) -> int:
+        """Remove expired entries and return how many were dropped"""
+        # Entries are ordered by last access and share one TTL, so expired ones sit at the front
+        now = time.monotonic()
+        removed = 0
+        while self._data:
+            key, (_, expires_at) = next(iter(self._data.items()))
+            if expires_at > now:
+                break
+            del self._data[key]
+            removed += 1
+        return removed
@@ -1,7 +1,8 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
+import asyncio
 import os
 from dotenv import load_dotenv
 from pathlib import Path
@@ -9,6 +10,9 @@ from pathlib import Path
 from app.api import documents, patients, chat
 from app.services.gemini_service import GeminiService
 from app.services.rag_service import RAGService
+from app.services.chat_context_service import chat_context_service, SESSION_TTL_SECONDS
+from app.services.session_store import CHAT_SPOOL_DIR
+from app.utils.file_utils import cleanup_old_files
 
 # Load environment variables
 load_dotenv()
@@ -16,7 +20,8 @@ load_dotenv()
 app = FastAPI(
     title="Patient Document Management API",
     description="API for managing patient documents with AI transcription and RAG chat",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -28,9 +33,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Background task that evicts idle in-memory chat sessions
+_session_janitor = None
+
+async def expire_chat_sessions():
+    """Periodically evict expired chat sessions and spooled upload files"""
+    while True:
+        await asyncio.sleep(60)
+        try:
+            chat_context_service.expire_stale()
+            await asyncio.to_thread(cleanup_old_files, CHAT_SPOOL_DIR, SESSION_TTL_SECONDS / 3600)
+        except Exception as e:
+            print(f"❌ Session cleanup error: {str(e)}")
+
 # Initialize services on startup (no database table creation needed for Supabase)
 @app.on_event("startup")
-def startup():
+async def startup():
+    global _session_janitor
     # Skip table creation - using Supabase REST API
     print("🚀 Starting PatientDB API...")
     print("✅ Using Supabase for data storage (tables already exist)")
@@ -41,6 +60,13 @@ def startup():
         print(f"🔗 Connected to Supabase: {supabase_url}")
     else:
         print("📁 Using local SQLite fallback")
+    
+    _session_janitor = asyncio.create_task(expire_chat_sessions())
+
+@app.on_event("shutdown")
+async def shutdown():
+    if _session_janitor:
+        _session_janitor.cancel()
 
 # Include routers
 app.include_router(documents.router, prefix="/api/documents", tags=["documents"])
@@ -106,4 +132,10 @@ async def health_check():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port, reload=False)
+    # uvloop replaces the default selector loop on the socket-heavy upload paths (not available on Windows)
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+    uvicorn.run(app, host="0.0.0.0", port=port, reload=False, loop=loop)